@@ -1,180 +1,205 @@
 import asyncio
+from pathlib import Path
 from playwright.async_api import async_playwright
-import json
 
-async def capture_headers():
+# Seconds a headless capture may take before giving up
+DEFAULT_CAPTURE_TIMEOUT = 20.0
+
+# Seconds the visible browser waits for manual browsing when automatic capture fails
+MANUAL_CAPTURE_TIMEOUT = 300.0
+
+# Browser profiles kept between runs (cache, cookies), one per captured session
+PROFILE_DIR = Path(__file__).parent / 'browser_profile'
+
+# Pages that call the marketplace API, visited in order until the headers show up
+CAPTURE_URLS = [
+    'https://www.ifood.com.br/delivery/sao-paulo-sp',
+    'https://www.ifood.com.br/delivery/sao-paulo-sp/restaurantes',
+]
+
+REQUIRED_HEADERS = {
+    'x-ifood-session-id': 'X-Ifood-Session-Id',
+    'x-client-application-key': 'x-client-application-key',
+}
+
+
+async def drive_page(page):
+    """Navigate and scroll through pages that call the marketplace API (no fixed waits)"""
+    for url in CAPTURE_URLS:
+        print(f"Navigating to: {url}")
+        await page.goto(url, wait_until='domcontentloaded')
+        # Lazy-loaded merchant lists fire their API calls on scroll
+        await page.mouse.wheel(0, 2000)
+        await page.wait_for_load_state('networkidle')
+
+    # Last resort: type an address so the site has a location to load merchants for
+    print("\nTrying to find address input...")
+    for selector in ['input[placeholder*="Rua"]', 'input[placeholder*="endereço"]', 'input[placeholder*="CEP"]',
+                     'input[data-test-id*="address"]', 'input[type="text"]']:
+        input_field = page.locator(selector).first
+        if await input_field.is_visible():
+            print(f"Found input field: {selector}")
+            await input_field.fill("Avenida Paulista, 1578, São Paulo")
+            await input_field.press('Enter')
+            await page.wait_for_load_state('networkidle')
+            return
+
+
+async def capture_headers(headless=True, timeout=DEFAULT_CAPTURE_TIMEOUT, profile=None, fresh=False,
+                          manual_timeout=0.0):
+    """
+    Capture iFood session headers from the browser's own API requests
+
+    Returns as soon as a request to the marketplace API has carried both
+    headers: the request handler resolves a future that the capture waits
+    on (with an overall timeout), while the page is driven in the
+    background. The browser profile is kept on disk, so later launches
+    start warm.
+
+    Args:
+        headless: Run Chromium without a window
+        timeout: Seconds to wait for the headers
+        profile: Profile directory (default: PROFILE_DIR / 'session-0')
+        fresh: Clear iFood cookies and site storage first, so the site issues a
+               new session instead of the one stored in the profile
+        manual_timeout: Extra seconds to wait for manual browsing when the
+                        automatic capture times out (visible browser only)
+
+    Returns:
+        dict: X-Ifood-Session-Id and x-client-application-key, or empty dict
+    """
     captured_headers = {}
+    loop = asyncio.get_running_loop()
+    found = loop.create_future()
+    profile = Path(profile or PROFILE_DIR / 'session-0')
+    profile.mkdir(parents=True, exist_ok=True)
 
     async with async_playwright() as p:
-        # Launch browser
-        browser = await p.chromium.launch(headless=False)
-        context = await browser.new_context(
+        context = await p.chromium.launch_persistent_context(
+            str(profile),
+            headless=headless,
             viewport={'width': 1920, 'height': 1080},
             user_agent='Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36',
             geolocation={'latitude': -23.5505, 'longitude': -46.6333},  # São Paulo coordinates
             permissions=['geolocation']
         )
-        page = await context.new_page()
+        page = context.pages[0] if context.pages else await context.new_page()
 
-        # Listen for requests to marketplace.ifood.com.br
-        async def handle_request(request):
-            if 'marketplace.ifood.com.br' in request.url or 'cw-marketplace.ifood.com.br' in request.url:
-                headers = await request.all_headers()
-                if 'x-ifood-session-id' in headers:
-                    captured_headers['X-Ifood-Session-Id'] = headers['x-ifood-session-id']
-                if 'x-client-application-key' in headers:
-                    captured_headers['x-client-application-key'] = headers['x-client-application-key']
+        if fresh:
+            cdp = await context.new_cdp_session(page)
+            await cdp.send('Storage.clearDataForOrigin', {
+                'origin': 'https://www.ifood.com.br',
+                'storageTypes': 'cookies,local_storage,session_storage,indexeddb,service_workers,cache_storage'
+            })
+            await context.clear_cookies()
 
+        # Resolve the future the moment a marketplace request carries both headers
+        async def handle_request(request):
+            if found.done() or 'marketplace.ifood.com.br' not in request.url:
+                return
+            headers = await request.all_headers()
+            for name, key in REQUIRED_HEADERS.items():
+                if name in headers:
+                    captured_headers[key] = headers[name]
+            if len(captured_headers) == len(REQUIRED_HEADERS) and not found.done():
                 print(f"\n[+] Captured request to: {request.url[:80]}...")
-                if 'X-Ifood-Session-Id' in captured_headers and 'x-client-application-key' in captured_headers:
-                    print(f"\n[+] X-Ifood-Session-Id: {captured_headers['X-Ifood-Session-Id']}")
-                    print(f"[+] x-client-application-key: {captured_headers['x-client-application-key']}")
+                found.set_result(dict(captured_headers))
 
         page.on('request', handle_request)
 
         print("Opening iFood website...")
-        await page.goto('https://www.ifood.com.br', wait_until='domcontentloaded')
-        await page.wait_for_timeout(3000)
+        driver = asyncio.ensure_future(drive_page(page))
+        try:
+            await asyncio.wait_for(asyncio.shield(found), timeout)
+        except asyncio.TimeoutError:
+            if not headless and manual_timeout > 0:
+                print("\n[!] Could not capture headers automatically.")
+                print("The browser will stay open for manual intervention...")
+                print("\nPlease:")
+                print("  1. Enter your location")
+                print("  2. Browse restaurants")
+                print("  3. Wait for headers to be captured")
+                try:
+                    await asyncio.wait_for(asyncio.shield(found), manual_timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            driver.cancel()
+            await asyncio.gather(driver, return_exceptions=True)
+            await context.close()
+
+    if not found.done():
+        print("\n[!] Could not capture headers automatically.")
+        return {}
 
-        print("\nAutomatically entering São Paulo address...")
+    captured_headers = found.result()
+    print("\n" + "="*60)
+    print("SUCCESS! Headers captured:")
+    print("="*60)
+    print(f"\nX-Ifood-Session-Id: {captured_headers['X-Ifood-Session-Id']}")
+    print(f"x-client-application-key: {captured_headers['x-client-application-key']}")
+    print("\n" + "="*60)
+    return captured_headers
 
-        # Strategy 1: Try to navigate directly to a location-specific URL
-        try:
-            # Navigate to São Paulo with coordinates
-            sao_paulo_url = 'https://www.ifood.com.br/delivery/sao-paulo-sp'
-            print(f"Navigating to: {sao_paulo_url}")
-            await page.goto(sao_paulo_url, wait_until='domcontentloaded')
-            await page.wait_for_timeout(5000)
-
-            if 'X-Ifood-Session-Id' in captured_headers and 'x-client-application-key' in captured_headers:
-                print("\n[+] Headers captured from navigation!")
-            else:
-                # Try scrolling to trigger lazy-loaded content
-                print("Scrolling page to trigger API calls...")
-                await page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                await page.wait_for_timeout(3000)
 
-        except Exception as e:
-            print(f"Navigation attempt failed: {e}")
-
-        # Strategy 2: Try finding and filling address input
-        if not (captured_headers.get('X-Ifood-Session-Id') and captured_headers.get('x-client-application-key')):
-            print("\nTrying to find address input...")
-            try:
-                # Common selectors for iFood address input
-                address_selectors = [
-                    'input[placeholder*="Rua"]',
-                    'input[placeholder*="endereço"]',
-                    'input[placeholder*="CEP"]',
-                    'input[type="text"]',
-                    'input[data-test-id*="address"]',
-                ]
-
-                for selector in address_selectors:
-                    try:
-                        input_field = page.locator(selector).first
-                        if await input_field.is_visible(timeout=2000):
-                            print(f"Found input field: {selector}")
-                            await input_field.click()
-                            await page.wait_for_timeout(1000)
-                            # Type a São Paulo address
-                            await input_field.fill("Avenida Paulista, 1578, São Paulo")
-                            await page.wait_for_timeout(2000)
-
-                            # Press Enter or look for submit button
-                            await input_field.press('Enter')
-                            await page.wait_for_timeout(5000)
-                            break
-                    except:
-                        continue
-
-            except Exception as e:
-                print(f"Address input attempt failed: {e}")
-
-        # Strategy 3: Direct API call simulation
-        if not (captured_headers.get('X-Ifood-Session-Id') and captured_headers.get('x-client-application-key')):
-            print("\nTrying direct marketplace URL...")
-            try:
-                # Navigate to a direct marketplace endpoint that should trigger the API
-                marketplace_url = 'https://www.ifood.com.br/delivery/sao-paulo-sp/restaurantes'
-                await page.goto(marketplace_url, wait_until='domcontentloaded')
-                await page.wait_for_timeout(8000)
-
-                # Scroll to load more content
-                for i in range(3):
-                    await page.evaluate("window.scrollBy(0, 500)")
-                    await page.wait_for_timeout(2000)
-
-            except Exception as e:
-                print(f"Marketplace URL attempt failed: {e}")
-
-        # Final check
-        if captured_headers.get('X-Ifood-Session-Id') and captured_headers.get('x-client-application-key'):
-            print("\n" + "="*60)
-            print("SUCCESS! Headers captured:")
-            print("="*60)
-            print(f"\nX-Ifood-Session-Id: {captured_headers['X-Ifood-Session-Id']}")
-            print(f"x-client-application-key: {captured_headers['x-client-application-key']}")
-            print("\n" + "="*60)
-
-            # Save to file
-            with open('captured_headers.json', 'w') as f:
-                json.dump(captured_headers, f, indent=2)
-            print("Headers saved to: captured_headers.json")
-        else:
-            print("\n[!] Could not capture headers automatically.")
-            print("The browser will stay open for manual intervention...")
-            print("\nPlease:")
-            print("  1. Enter your location")
-            print("  2. Browse restaurants")
-            print("  3. Wait for headers to be captured")
-            print("\nPress Ctrl+C when done...")
-
-            # Keep browser open and wait
-            try:
-                await page.wait_for_timeout(300000)  # Wait 5 minutes
-            except:
-                pass
-
-        # Keep browser open briefly
-        await page.wait_for_timeout(3000)
-        await browser.close()
-
-        return captured_headers
-
-
-async def capture_headers_automated():
+async def capture_headers_automated(sessions=1, headless=True, fresh=False, manual_fallback=True, first_profile=0,
+                                    save=True):
     """
     Automated header capture function for integration with main script
 
+    Each session is captured with its own browser profile, so every one gets
+    an independent X-Ifood-Session-Id. With more than one session the file
+    lists them all under 'sessions', each with its capture time (see
+    scraper_core.save_headers).
+
+    Args:
+        sessions: Number of independent sessions to capture
+        headless: Capture without a browser window
+        fresh: Ask for new sessions instead of the ones stored in the profiles
+               (e.g. to replace an expired session)
+        manual_fallback: When a headless capture fails, retry with a visible
+                         browser that waits for manual browsing
+        first_profile: Index of the browser profile used for the first session
+                       (e.g. the slot of an expired session being replaced)
+        save: Write captured_headers.json; False only returns the headers, so a
+              caller holding several sessions can save them all at once
+
     Returns:
         dict: Captured headers with X-Ifood-Session-Id and x-client-application-key
+              (plus 'sessions' when more than one was captured)
               Returns empty dict if capture fails
     """
-    try:
-        headers = await capture_headers()
-        if headers and 'X-Ifood-Session-Id' in headers and 'x-client-application-key' in headers:
-            # Save to file with timestamp
-            import json
-            from datetime import datetime
+    from datetime import datetime
 
+    captured = []
+    for index in range(sessions):
+        if sessions > 1:
+            print(f"\n[+] Capturing session {index + 1} of {sessions}...")
+        profile = PROFILE_DIR / f'session-{first_profile + index}'
+        try:
+            headers = await capture_headers(headless=headless, profile=profile, fresh=fresh)
+            if not headers and headless and manual_fallback:
+                headers = await capture_headers(headless=False, profile=profile, fresh=fresh,
+                                                manual_timeout=MANUAL_CAPTURE_TIMEOUT)
+        except Exception as e:
+            print(f"\n[!] Error during header capture: {e}")
+            continue
+        if headers:
             headers['timestamp'] = datetime.now().isoformat()
+            captured.append(headers)
 
-            with open('captured_headers.json', 'w') as f:
-                json.dump(headers, f, indent=2)
-
-            return headers
-        else:
-            return {}
-    except Exception as e:
-        print(f"\n[!] Error during header capture: {e}")
+    if not captured:
         return {}
 
+    from scraper_core import headers_document, save_headers
+    return save_headers(captured) if save else headers_document(captured)
+
 
 if __name__ == '__main__':
-    headers = asyncio.run(capture_headers())
+    headers = asyncio.run(capture_headers_automated())
 
     if headers:
+        print("\nHeaders saved to: captured_headers.json")
         print("\n[+] Done! Use these headers in your script.")
     else:
         print("\n[!] Could not capture headers automatically.")
@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+iFood Coverage Planner
+Plans discovery coordinates that cover an area with as few feed walks as possible
+
+A hex or square grid is laid over a bounding box or polygon, spaced so the
+delivery radius around each point covers the area without gaps. Each point is
+probed with a discovery call: points whose feed is saturated (it hits the
+page limit) are split into finer points, and points that add few new
+merchant IDs are left out. The result is written in the coordinates.json
+format that scraper_core.load_coordinates reads.
+
+Usage:
+    python coverage_planner.py --bbox=-23.70,-46.80,-23.45,-46.45
+    python coverage_planner.py --polygon zona_sul.geojson --shape square --radius 3000
+    python coverage_planner.py --bbox=-23.70,-46.80,-23.45,-46.45 --static
+"""
+
+import argparse
+import json
+import math
+import sys
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+# Meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111_320.0
+
+# Typical distance merchants deliver to, in meters
+DEFAULT_DELIVERY_RADIUS = 4000.0
+
+# Merchant IDs per home feed page (see scraper_core.fetch_merchant_ids_from_location)
+FEED_PAGE_SIZE = 100
+
+# A probe that reaches this many IDs with the feed still going is saturated
+DEFAULT_SATURATION = 500
+
+# Points adding fewer new IDs than this are left out of the plan
+DEFAULT_MIN_NEW_IDS = 10
+
+# How many times a saturated point may be split (each split halves the spacing)
+DEFAULT_MAX_DEPTH = 2
+
+GRID_SHAPES = ('hex', 'square')
+
+# (lat, lon) vertices; a bounding box is a 4-vertex polygon
+Polygon = List[Tuple[float, float]]
+
+
+class Cell(NamedTuple):
+    """A grid point and the spacing of the grid it belongs to"""
+    lat: float
+    lon: float
+    spacing: float  # meters to the neighbouring points
+    depth: int  # 0 for the initial grid, +1 per split
+
+
+class Probe(NamedTuple):
+    """What a discovery call at a cell returned"""
+    merchant_ids: List[str]
+    saturated: bool  # the feed was cut off at the page limit
+    pages: int
+
+
+class CellResult(NamedTuple):
+    cell: Cell
+    found: int
+    new: int
+    saturated: bool
+    kept: bool
+
+
+def parse_bbox(text: str) -> Polygon:
+    """
+    Parse 'south,west,north,east' into a polygon
+
+    Args:
+        text: Comma-separated latitudes/longitudes in degrees
+
+    Returns:
+        The box's four corners
+    """
+    try:
+        south, west, north, east = (float(value) for value in text.split(','))
+    except ValueError:
+        raise ValueError(f"Invalid bounding box {text!r} (expected south,west,north,east)")
+    if south >= north or west >= east:
+        raise ValueError(f"Invalid bounding box {text!r}: south/west must be below north/east")
+    return [(south, west), (south, east), (north, east), (north, west)]
+
+
+def load_polygon(filepath: str) -> Polygon:
+    """
+    Load the outer ring of a polygon from a GeoJSON file
+
+    Accepts a Polygon or MultiPolygon geometry, a Feature or the first
+    feature of a FeatureCollection; the first polygon is used.
+
+    Args:
+        filepath: Path to the GeoJSON file
+
+    Returns:
+        (lat, lon) vertices
+    """
+    with open(filepath, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    if data.get('type') == 'FeatureCollection':
+        data = data['features'][0]
+    if data.get('type') == 'Feature':
+        data = data['geometry']
+    if data.get('type') == 'MultiPolygon':
+        ring = data['coordinates'][0][0]
+    elif data.get('type') == 'Polygon':
+        ring = data['coordinates'][0]
+    else:
+        raise ValueError(f"{filepath}: expected a Polygon or MultiPolygon, got {data.get('type')!r}")
+
+    # GeoJSON positions are [lon, lat]
+    return [(float(lat), float(lon)) for lon, lat in ring]
+
+
+def to_meters(lat: float, lon: float, origin: Tuple[float, float]) -> Tuple[float, float]:
+    """Local (x, y) in meters from `origin` (equirectangular, fine at city scale)"""
+    x = (lon - origin[1]) * METERS_PER_DEGREE * math.cos(math.radians(origin[0]))
+    y = (lat - origin[0]) * METERS_PER_DEGREE
+    return x, y
+
+
+def offset(lat: float, lon: float, dx: float, dy: float) -> Tuple[float, float]:
+    """Point `dx` meters east and `dy` meters north of (lat, lon)"""
+    return (lat + dy / METERS_PER_DEGREE,
+            lon + dx / (METERS_PER_DEGREE * math.cos(math.radians(lat))))
+
+
+def contains(polygon: Polygon, lat: float, lon: float) -> bool:
+    """Ray-casting point-in-polygon test"""
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        (lat_i, lon_i), (lat_j, lon_j) = polygon[i], polygon[j]
+        if (lat_i > lat) != (lat_j > lat):
+            crossing = lon_i + (lat - lat_i) * (lon_j - lon_i) / (lat_j - lat_i)
+            if lon < crossing:
+                inside = not inside
+        j = i
+    return inside
+
+
+def distance_to_boundary(polygon: Polygon, lat: float, lon: float) -> float:
+    """Meters from (lat, lon) to the nearest edge of the polygon"""
+    origin = (lat, lon)
+    points = [to_meters(vertex_lat, vertex_lon, origin) for vertex_lat, vertex_lon in polygon]
+    best = math.inf
+    for (x1, y1), (x2, y2) in zip(points, points[1:] + points[:1]):
+        dx, dy = x2 - x1, y2 - y1
+        length = dx * dx + dy * dy
+        t = 0.0 if length == 0 else max(0.0, min(1.0, -(x1 * dx + y1 * dy) / length))
+        best = min(best, math.hypot(x1 + t * dx, y1 + t * dy))
+    return best
+
+
+def covers(polygon: Polygon, lat: float, lon: float, reach: float) -> bool:
+    """Whether a point's delivery circle of `reach` meters touches the polygon"""
+    return contains(polygon, lat, lon) or distance_to_boundary(polygon, lat, lon) < reach
+
+
+def grid_spacing(radius: float, shape: str) -> float:
+    """
+    Distance between grid points whose delivery circles leave no gaps
+
+    Args:
+        radius: Delivery radius in meters
+        shape: 'hex' or 'square'
+
+    Returns:
+        Spacing in meters (radius * sqrt(3) for hex, radius * sqrt(2) for square)
+    """
+    if shape not in GRID_SHAPES:
+        raise ValueError(f"Unknown grid shape {shape!r} (expected one of {', '.join(GRID_SHAPES)})")
+    return radius * (math.sqrt(3) if shape == 'hex' else math.sqrt(2))
+
+
+def build_grid(polygon: Polygon, radius: float = DEFAULT_DELIVERY_RADIUS, shape: str = 'hex') -> List[Cell]:
+    """
+    Lay a grid over the polygon, sized to the delivery radius
+
+    Points are kept when their delivery circle touches the polygon, so edges
+    are covered too.
+
+    Args:
+        polygon: (lat, lon) vertices of the area
+        radius: Delivery radius in meters
+        shape: 'hex' (fewest points) or 'square'
+
+    Returns:
+        Grid cells, row by row from the south-west corner
+    """
+    spacing = grid_spacing(radius, shape)
+    south = min(lat for lat, _ in polygon)
+    north = max(lat for lat, _ in polygon)
+    west = min(lon for _, lon in polygon)
+    east = max(lon for _, lon in polygon)
+    width, height = to_meters(north, east, (south, west))
+
+    # Hex rows are sqrt(3)/2 apart and every other row is shifted by half a spacing
+    row_step = spacing * math.sqrt(3) / 2 if shape == 'hex' else spacing
+    cells = []
+    for row in range(int(height // row_step) + 2):
+        shift = spacing / 2 if shape == 'hex' and row % 2 else 0.0
+        for column in range(int(width // spacing) + 2):
+            lat, lon = offset(south, west, column * spacing + shift - spacing / 2, row * row_step - row_step / 2)
+            if covers(polygon, lat, lon, radius):
+                cells.append(Cell(lat, lon, spacing, 0))
+    return cells
+
+
+def split_cell(cell: Cell, shape: str) -> List[Cell]:
+    """
+    Replace a cell by a grid of half the spacing over the same footprint
+
+    Args:
+        cell: Cell to split
+        shape: Grid shape of the cell
+
+    Returns:
+        Child cells (4 for square, the center and 6 around it for hex)
+    """
+    spacing = cell.spacing / 2
+    if shape == 'hex':
+        offsets = [(0.0, 0.0)] + [
+            (spacing * math.cos(math.radians(angle)), spacing * math.sin(math.radians(angle)))
+            for angle in range(0, 360, 60)
+        ]
+    else:
+        quarter = cell.spacing / 4
+        offsets = [(dx, dy) for dx in (-quarter, quarter) for dy in (-quarter, quarter)]
+    return [Cell(*offset(cell.lat, cell.lon, dx, dy), spacing, cell.depth + 1) for dx, dy in offsets]
+
+
+def make_feed_probe(category: str, headers: dict, saturation: int = DEFAULT_SATURATION, max_retries: int = 3,
+                    cache=None) -> Callable[[Cell], Probe]:
+    """
+    Probe cells with real discovery calls
+
+    Each probe walks a cell's home feed up to the pages needed to reach
+    `saturation` IDs. Feeds that end before that are complete walks and are
+    stored in `cache`, so the first scrape of the planned coordinates reuses
+    them instead of calling the API again.
+
+    Args:
+        category: Category alias whose feed is probed
+        headers: Full request headers (scraper_core.build_full_headers)
+        saturation: IDs at which a feed that is still going counts as saturated
+        max_retries: Attempts per page for retryable errors
+        cache: Optional scraper_core.DiscoveryCache to store complete walks in
+
+    Returns:
+        Function mapping a Cell to its Probe
+    """
+    import scraper_core
+
+    max_pages = max(1, math.ceil(saturation / FEED_PAGE_SIZE))
+
+    def probe(cell: Cell) -> Probe:
+        lat, lon = f'{cell.lat:.8f}', f'{cell.lon:.8f}'
+        pages = []
+        merchant_ids = scraper_core.fetch_merchant_ids_from_location(
+            category, lat, lon, headers, max_retries, on_page=pages.append, max_pages=max_pages
+        )
+        saturated = len(pages) >= max_pages and pages[-1].cursor is not None and bool(pages[-1].merchant_ids)
+        complete = bool(pages) and not saturated and (pages[-1].cursor is None or not pages[-1].merchant_ids)
+        if cache is not None and complete:
+            cache.put(category, lat, lon, pages[0].merchant_ids, merchant_ids)
+        return Probe(merchant_ids, saturated, len(pages))
+
+    return probe
+
+
+def plan_coverage(
+    polygon: Polygon,
+    probe: Callable[[Cell], Probe],
+    radius: float = DEFAULT_DELIVERY_RADIUS,
+    shape: str = 'hex',
+    min_new: int = DEFAULT_MIN_NEW_IDS,
+    max_depth: int = DEFAULT_MAX_DEPTH,
+    max_calls: Optional[int] = None
+) -> Tuple[List[Cell], List[CellResult]]:
+    """
+    Probe a grid over the area and refine it where the feed is saturated
+
+    Cells are probed breadth-first. A saturated cell is split into a finer
+    grid (see split_cell) down to `max_depth`; children outside the area or
+    on a point already probed are dropped. A cell is kept in the plan only
+    if it adds at least `min_new` merchant IDs that no kept cell covers yet;
+    IDs seen only at skipped cells still count as new for later cells.
+
+    Args:
+        polygon: (lat, lon) vertices of the area
+        probe: Function returning a cell's Probe (see make_feed_probe)
+        radius: Delivery radius in meters for the initial grid
+        shape: 'hex' or 'square'
+        min_new: New IDs a cell must add to be kept
+        max_depth: Maximum number of splits of an initial cell
+        max_calls: Optional budget of feed pages for the whole plan (checked
+                   before each probe, so it can be exceeded by one probe)
+
+    Returns:
+        (kept cells in probe order, a CellResult for every probed cell)
+    """
+    pending = build_grid(polygon, radius, shape)
+    covered_ids: Set[str] = set()  # IDs found at kept cells
+    seen_ids: Set[str] = set()  # IDs found anywhere, for the summary
+    probed: Set[Tuple[float, float]] = set()
+    results: List[CellResult] = []
+    calls = 0
+
+    print(f"   Initial {shape} grid: {len(pending)} points, {grid_spacing(radius, shape):.0f} m apart")
+    while pending:
+        cell = pending.pop(0)
+        key = (round(cell.lat, 5), round(cell.lon, 5))  # about 1 m
+        if key in probed:
+            continue
+        if max_calls is not None and calls >= max_calls:
+            print(f"   Call budget of {max_calls} pages reached, {len(pending) + 1} points left unprobed")
+            break
+        probed.add(key)
+
+        result = probe(cell)
+        calls += result.pages
+        new = len(set(result.merchant_ids) - covered_ids)
+        kept = new >= min_new
+        if kept:
+            covered_ids.update(result.merchant_ids)
+        seen_ids.update(result.merchant_ids)
+        results.append(CellResult(cell, len(result.merchant_ids), new, result.saturated, kept))
+
+        status = 'kept' if kept else 'skipped (few new IDs)'
+        if result.saturated and cell.depth < max_depth:
+            children = [child for child in split_cell(cell, shape) if covers(polygon, child.lat, child.lon, child.spacing)]
+            pending.extend(children)
+            status += f', saturated: split into {len(children)}'
+        print(f"   [{len(results)}] ({cell.lat:.5f}, {cell.lon:.5f}) depth {cell.depth}: "
+              f"{len(result.merchant_ids)} IDs, {new} new - {status}", flush=True)
+
+    kept_cells = [result.cell for result in results if result.kept]
+    print(f"   {len(kept_cells)} of {len(results)} probed points kept, covering {len(covered_ids)} unique merchants "
+          f"({len(seen_ids - covered_ids)} more seen only at skipped points), {calls} feed pages used")
+    return kept_cells, results
+
+
+def save_coordinates(cells: List[Cell], filepath: str = 'coordinates.json') -> Dict:
+    """
+    Write cells in the coordinates.json format (see scraper_core.load_coordinates)
+
+    Args:
+        cells: Cells to write
+        filepath: Output file
+
+    Returns:
+        The document written
+    """
+    data = {
+        'coordinates': [{'lat': f'{cell.lat:.8f}', 'lon': f'{cell.lon:.8f}'} for cell in cells],
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+        'count': len(cells)
+    }
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    return data
+
+
+def main():
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(
+        description='Plan discovery coordinates covering an area with the fewest feed walks',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python coverage_planner.py --bbox=-23.70,-46.80,-23.45,-46.45
+  python coverage_planner.py --polygon zona_sul.geojson --category MERCADO_FARMACIA
+  python coverage_planner.py --bbox=-23.70,-46.80,-23.45,-46.45 --static --shape square
+        """
+    )
+    area = parser.add_mutually_exclusive_group(required=True)
+    area.add_argument('--bbox', type=str,
+                      help='Bounding box as south,west,north,east in degrees (write --bbox=... for negative values)')
+    area.add_argument('--polygon', type=str, help='GeoJSON file with the area polygon')
+    parser.add_argument('--shape', type=str, default='hex', choices=list(GRID_SHAPES),
+                        help='Grid shape; hex needs fewer points for the same coverage (default: hex)')
+    parser.add_argument('--radius', type=float, default=DEFAULT_DELIVERY_RADIUS,
+                        help=f'Typical delivery radius in meters (default: {DEFAULT_DELIVERY_RADIUS:.0f})')
+    parser.add_argument('--category', type=str, default='HOME_FOOD_DELIVERY',
+                        help='Category whose feed is probed (default: HOME_FOOD_DELIVERY)')
+    parser.add_argument('--saturation', type=int, default=DEFAULT_SATURATION,
+                        help=f'IDs at which a feed still going counts as saturated and the point is split '
+                             f'(default: {DEFAULT_SATURATION})')
+    parser.add_argument('--min-new', type=int, default=DEFAULT_MIN_NEW_IDS,
+                        help=f'New merchant IDs a point must add to be kept (default: {DEFAULT_MIN_NEW_IDS})')
+    parser.add_argument('--max-depth', type=int, default=DEFAULT_MAX_DEPTH,
+                        help=f'How many times a saturated point may be split (default: {DEFAULT_MAX_DEPTH})')
+    parser.add_argument('--max-calls', type=int, default=None,
+                        help='Budget of feed pages for the whole plan (default: unlimited)')
+    parser.add_argument('--static', action='store_true',
+                        help='Only lay out the grid, without probing the API')
+    parser.add_argument('--headers', type=str, default='captured_headers.json',
+                        help='Captured headers file (default: captured_headers.json)')
+    parser.add_argument('--discovery-cache', type=str, default='discovery_cache.db',
+                        help='Discovery cache primed with complete probes; "" disables (default: discovery_cache.db)')
+    parser.add_argument('--output', type=str, default='coordinates.json',
+                        help='Output file (default: coordinates.json)')
+    args = parser.parse_args()
+
+    try:
+        polygon = parse_bbox(args.bbox) if args.bbox else load_polygon(args.polygon)
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        print(f"[!] Could not read the area: {e}")
+        sys.exit(1)
+
+    if args.static:
+        cells = build_grid(polygon, args.radius, args.shape)
+        print(f"   {args.shape} grid: {len(cells)} points, {grid_spacing(args.radius, args.shape):.0f} m apart")
+    else:
+        import scraper_core
+
+        if args.category not in scraper_core.CATEGORY_STRUCTURE:
+            print(f"[!] Unknown category {args.category}")
+            sys.exit(1)
+        headers_data = scraper_core.load_headers(args.headers)
+        if not headers_data.get('X-Ifood-Session-Id'):
+            print(f"[!] No session in {args.headers}; capture headers first (python capture_ifood_headers.py)")
+            sys.exit(1)
+
+        cache = scraper_core.DiscoveryCache(args.discovery_cache) if args.discovery_cache else None
+        probe = make_feed_probe(args.category, scraper_core.build_full_headers(headers_data), args.saturation,
+                                cache=cache)
+        cells, _ = plan_coverage(polygon, probe, args.radius, args.shape, args.min_new, args.max_depth, args.max_calls)
+        if cache:
+            cache.close()
+
+    save_coordinates(cells, args.output)
+    print(f"[+] {len(cells)} coordinates saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -13,8 +13,8 @@ import sys
 import json
 import asyncio
 import webbrowser
-from pathlib import Path
 from datetime import datetime
+from pathlib import Path
 
 
 # Category options
@@ -114,12 +114,79 @@ def select_coordinates(skip_map=False):
         return None
 
 
-def capture_headers(skip_headers=False):
+def validate_cached_headers(headers_path, sessions=1, accept_fewer=False):
+    """
+    Reuse captured_headers.json when a cheap probe says its sessions still work
+
+    Each cached session gets one minimal request (scraper_core.probe_headers)
+    instead of a browser launch. Sessions that pass are stamped with their
+    age and last validation time in the file.
+
+    Args:
+        headers_path: Path to captured_headers.json
+        sessions: Number of sessions the run wants
+        accept_fewer: Reuse the file even if it has fewer sessions than wanted
+
+    Returns:
+        dict: Headers data, or None when fresh headers must be captured
+    """
+    if not headers_path.exists():
+        print_info("No captured_headers.json found")
+        return None
+    try:
+        with open(headers_path, 'r', encoding='utf-8') as f:
+            headers_data = json.load(f)
+    except Exception as e:
+        print_error(f"Failed to load headers: {e}")
+        return None
+
+    import scraper_core
+
+    cached = scraper_core.load_header_sessions(headers_data)
+    if not cached:
+        print_error("captured_headers.json has no session")
+        return None
+    if len(cached) < sessions and not accept_fewer:
+        print_info(f"captured_headers.json has {len(cached)} of the {sessions} sessions wanted")
+        return None
+
+    print_info(f"Validating {len(cached)} cached session(s) with one request each...")
+    now = datetime.now()
+    for index, session in enumerate(cached, 1):
+        try:
+            age = (now - datetime.fromisoformat(session['timestamp'])).total_seconds()
+            age_text = f"captured {age / 3600:.1f}h ago"
+        except (KeyError, TypeError, ValueError):
+            age, age_text = None, "capture time unknown"
+
+        error = scraper_core.probe_headers(session)
+        if error is not None and error.kind in scraper_core.DEAD_SESSION_ERRORS:
+            print_error(f"  - Session {index} ({age_text}) is no longer accepted: {error}")
+            return None
+        if error is not None:
+            # Network trouble or throttling says nothing about the session itself
+            print_info(f"  - Session {index} ({age_text}) could not be checked ({error}), keeping it")
+            continue
+
+        session['last_validated'] = now.isoformat()
+        if age is not None:
+            session['age_seconds'] = round(age)
+        print_success(f"  - Session {index} is valid ({age_text})")
+
+    return scraper_core.save_headers(cached, headers_path)
+
+
+def capture_headers(skip_headers=False, sessions=1, recapture=False):
     """
     Step 2: Capture fresh session headers from iFood
 
+    Cached headers that still pass a one-request probe are reused, so the
+    browser is only launched when they are missing or have expired.
+
     Args:
-        skip_headers: If True, try to load existing captured_headers.json
+        skip_headers: Reuse captured_headers.json even with fewer sessions than wanted
+        sessions: Number of independent sessions to capture
+        recapture: Always capture new headers, without trying the cached ones
 
     Returns:
         dict: Headers data or None if failed
@@ -128,94 +195,136 @@ def capture_headers(skip_headers=False):
 
     headers_path = Path(__file__).parent / 'captured_headers.json'
 
-    # Check if we should skip header capture
-    if skip_headers:
-        if headers_path.exists():
-            print_info("Skipping header capture, loading existing headers...")
-            try:
-                with open(headers_path, 'r', encoding='utf-8') as f:
-                    headers_data = json.load(f)
-                print_success("Loaded headers from file")
-                print_info(f"  - Session ID: {headers_data.get('X-Ifood-Session-Id', 'N/A')[:16]}...")
-                print_info(f"  - App Key: {headers_data.get('x-client-application-key', 'N/A')[:16]}...")
-                return headers_data
-            except Exception as e:
-                print_error(f"Failed to load headers: {e}")
-                print_info("Falling back to header capture...")
-        else:
-            print_error("No existing captured_headers.json found")
-            print_info("Falling back to header capture...")
+    if not recapture:
+        headers_data = validate_cached_headers(headers_path, sessions, accept_fewer=skip_headers)
+        if headers_data:
+            print_success("Reusing cached headers, no browser needed")
+            print_info(f"  - Session ID: {headers_data.get('X-Ifood-Session-Id', 'N/A')[:16]}...")
+            print_info(f"  - App Key: {headers_data.get('x-client-application-key', 'N/A')[:16]}...")
+            if 'sessions' in headers_data:
+                print_info(f"  - Sessions: {len(headers_data['sessions'])}")
+            return headers_data
+        print_info("Falling back to header capture...")
 
-    print_info("Opening iFood in browser...")
+    print_info("Opening iFood in a headless browser...")
     print_info("Capturing session headers automatically...")
-    print_info("[This may take 15-30 seconds]")
+    print_info("[This usually takes a few seconds; a browser window opens if it fails]")
     print()
 
     try:
         # Import and run header capture
         from capture_ifood_headers import capture_headers_automated
+        import scraper_core
 
-        # Run async function
-        headers_data = asyncio.run(capture_headers_automated())
+        # The browser profiles still hold the sessions of captured_headers.json, which were
+        # just rejected (or are being replaced on purpose): ask iFood for new ones
+        fresh = recapture or headers_path.exists()
+        headers_data = asyncio.run(capture_headers_automated(sessions, fresh=fresh, save=False))
 
         if headers_data and 'X-Ifood-Session-Id' in headers_data:
+            # Only save sessions iFood accepts, so the next run does not start from a dead one
+            captured = scraper_core.load_header_sessions(headers_data)
+            now = datetime.now().isoformat()
+            for index, session in enumerate(captured, 1):
+                error = scraper_core.probe_headers(session)
+                if error is not None and error.kind in scraper_core.DEAD_SESSION_ERRORS:
+                    print_error(f"Newly captured session {index} is rejected as well: {error}")
+                    print_info("iFood may be blocking this machine; wait a while before trying again")
+                    return None
+                if error is None:
+                    session['last_validated'] = now
+            headers_data = scraper_core.save_headers(captured, headers_path)
+
             print_success("Headers captured successfully")
             print_info(f"  - Session ID: {headers_data['X-Ifood-Session-Id'][:16]}...")
             print_info(f"  - App Key: {headers_data.get('x-client-application-key', 'N/A')[:16]}...")
+            if sessions > 1:
+                print_info(f"  - Sessions: {len(headers_data.get('sessions', [headers_data]))} of {sessions} captured")
             return headers_data
-        else:
-            print_error("Automatic header capture failed")
-            print_info("Trying fallback: using headers from existing scripts...")
-
-            # Fallback: use headers from the original working scripts
-            fallback_headers = {
-                'X-Ifood-Session-Id': '8d1d8bd8-4382-4eba-a0f9-aec41525b12c',
-                'x-client-application-key': '41a266ee-51b7-4c37-9e9d-5cd331f280d5',
-                'timestamp': datetime.now().isoformat()
-            }
-
-            # Save fallback headers
-            with open(headers_path, 'w', encoding='utf-8') as f:
-                json.dump(fallback_headers, f, indent=2)
-
-            print_success("Using fallback headers from working scripts")
-            print_info("  Note: These headers may expire eventually")
-            print_info(f"  - Session ID: {fallback_headers['X-Ifood-Session-Id'][:16]}...")
-            print_info(f"  - App Key: {fallback_headers['x-client-application-key'][:16]}...")
-
-            return fallback_headers
 
+        print_error("Automatic header capture failed")
     except ImportError:
         print_error("Could not import capture_ifood_headers")
         print_info("Make sure playwright is installed: pip install playwright")
         return None
     except Exception as e:
         print_error(f"Error during header capture: {e}")
-        print_info("Using fallback headers...")
 
-        # Use fallback headers even on exception
-        fallback_headers = {
-            'X-Ifood-Session-Id': '8d1d8bd8-4382-4eba-a0f9-aec41525b12c',
-            'x-client-application-key': '41a266ee-51b7-4c37-9e9d-5cd331f280d5',
-            'timestamp': datetime.now().isoformat()
-        }
+    # Never fall back to session IDs baked into the script: they expire and the run would quietly return nothing
+    if recapture and headers_path.exists():
+        print_info("To try the previously captured headers instead, run again without --recapture")
+    return None
 
-        headers_path = Path(__file__).parent / 'captured_headers.json'
-        with open(headers_path, 'w', encoding='utf-8') as f:
-            json.dump(fallback_headers, f, indent=2)
 
-        print_success("Using fallback headers")
-        return fallback_headers
+def refresh_session(index=0):
+    """
+    Capture one new session in place of an expired one
+
+    Called by scraper_core.SessionRefresher on its background thread while
+    the run keeps going. The capture uses the expired slot's browser profile
+    and does not write captured_headers.json: the refresher's on_refresh
+    saves every session of the pool at once, so the file never holds only
+    the new one.
 
+    Args:
+        index: Slot of the expired session in the HeaderPool
 
-def run_scraper(category, coordinates_data, headers_data):
+    Returns:
+        dict: The new session, or empty dict if capture failed
+    """
+    from capture_ifood_headers import capture_headers_automated
+    # Headless only: nobody is watching for a browser window mid-run
+    return asyncio.run(capture_headers_automated(fresh=True, manual_fallback=False, first_profile=index, save=False))
+
+
+def run_scraper(category, coordinates_data, headers_data, engine='async', concurrency=100, workers=8,
+                pool_size=None, http_retries=None, discovery_workers=8, requests_per_second=None,
+                queue_size=1000, resume=False, journal_path='scrape_journal.db', cache_ttl=None,
+                cache_max_entries=None, cache_path='merchant_cache.db', discovery_cache_ttl=None,
+                revalidate=False, discovery_cache_path='discovery_cache.db', extra_fields=(),
+                batch_size=None, delta=False, state_path='delta_state.db', flush_interval=None,
+                output_format='csv', workbook=None, session_strategy='round-robin'):
     """
     Step 3: Run the scraper with selected coordinates and headers
 
     Args:
         category: Category to scrape (e.g., 'HOME_FOOD_DELIVERY')
         coordinates_data: Dictionary containing coordinates
-        headers_data: Dictionary containing captured headers
+        headers_data: Dictionary containing captured headers (one or several sessions);
+                      updated in place when an expired session is refreshed
+        engine: Detail fetch engine ('async' or 'pool')
+        concurrency: Maximum concurrent detail requests for the async engine
+        workers: Maximum worker processes for the pool engine
+        pool_size: Pooled connections per HTTP session (default: scraper_core.DEFAULT_POOL_SIZE)
+        http_retries: Transport-level retries per request (default: scraper_core.DEFAULT_HTTP_RETRIES)
+        discovery_workers: Locations paginated concurrently during discovery
+        requests_per_second: Request budget per host shared by discovery and details, or per
+                             session when several were captured
+                             (default: scraper_core.DEFAULT_REQUESTS_PER_SECOND)
+        queue_size: Maximum discovered IDs waiting for a detail worker
+        resume: Continue the previous run recorded in the journal instead of starting over
+        journal_path: SQLite checkpoint journal file
+        cache_ttl: Seconds a cached merchant detail row is reused; 0 disables the cache
+                   (default: scraper_core.DEFAULT_CACHE_TTL)
+        cache_max_entries: Rows kept in the detail cache (default: scraper_core.DEFAULT_CACHE_MAX_ENTRIES)
+        cache_path: SQLite detail cache file, shared by every category
+        discovery_cache_ttl: Seconds a location's cached merchant IDs are reused; 0 disables
+                             the cache (default: scraper_core.DEFAULT_DISCOVERY_CACHE_TTL)
+        revalidate: Reuse expired discovery entries whose first page is unchanged
+        discovery_cache_path: SQLite discovery cache file
+        extra_fields: Dotted GraphQL fields requested on top of the CSV columns
+                      (e.g. 'merchantExtra.shortId'); each becomes an extra column
+        batch_size: Maximum merchants per detail request, auto-tuned below it; 1 disables
+                    batching (default: scraper_core.DEFAULT_BATCH_SIZE)
+        delta: Write only new, changed and removed merchants instead of the full CSV
+        state_path: SQLite file with every merchant's row from the previous delta run
+        flush_interval: Seconds between writes of completed rows to the output file
+                        (default: the output format's own, see scraper_core.ResultSink)
+        output_format: 'csv', 'parquet', 'feather' or 'xlsx'
+        workbook: Optional scraper_core.XlsxWorkbook shared by several categories;
+                  this category is added to it as a sheet
+        session_strategy: How requests pick one of several captured sessions
+                          ('round-robin' or 'least-loaded')
 
     Returns:
         bool: True if successful, False otherwise
@@ -226,12 +335,49 @@ def run_scraper(category, coordinates_data, headers_data):
     print_info(f"Coordinates: {coordinates_data['count']} locations")
     print()
 
+    refresher = None
+    sink = None
+    journal = cache = discovery_cache = None
     try:
         import scraper_core
 
         # Build full headers
         headers = scraper_core.build_full_headers(headers_data)
 
+        # Request only the fields the CSV needs, plus any opted-in extras
+        scraper_core.set_detail_fields(extra_fields)
+
+        # Shared keep-alive session for discovery (and detail workers)
+        if pool_size is None:
+            pool_size = scraper_core.DEFAULT_POOL_SIZE
+        if http_retries is None:
+            http_retries = scraper_core.DEFAULT_HTTP_RETRIES
+        scraper_core.init_session(max(pool_size, discovery_workers), http_retries)
+
+        # One token bucket per host, shared by every thread, task and worker process
+        if requests_per_second is None:
+            requests_per_second = scraper_core.DEFAULT_REQUESTS_PER_SECOND
+        sessions = scraper_core.load_header_sessions(headers_data)
+        scraper_core.set_rate_limiter(scraper_core.RateLimiter(requests_per_second * max(1, len(sessions))))
+
+        # Requests go through a pool of the captured sessions, each with its own budget.
+        # A session that expires mid-run is recaptured in the background while its requests wait.
+        header_pool = None
+        if sessions:
+            header_pool = scraper_core.HeaderPool(sessions, requests_per_second, session_strategy)
+            if len(sessions) > 1:
+                print_info(f"Spreading requests across {len(sessions)} sessions ({session_strategy}), "
+                           f"{requests_per_second:g} requests/s each")
+
+            def on_refresh(pool):
+                # Later categories and --skip-headers runs start from the refreshed sessions
+                refreshed = scraper_core.save_headers(pool.sessions(), Path(__file__).parent / 'captured_headers.json')
+                headers_data.clear()
+                headers_data.update(refreshed)
+
+            refresher = scraper_core.SessionRefresher(header_pool, refresh_session, on_refresh=on_refresh)
+        scraper_core.set_header_pool(header_pool)
+
         # Load retry attempts
         max_retries = scraper_core.load_retry_attempts(category)
 
@@ -241,45 +387,161 @@ def run_scraper(category, coordinates_data, headers_data):
         # Use first coordinate as default for detail requests
         default_coord = coordinates[0]
 
-        # Step 3.1: Fetch merchant IDs from all locations
-        print_info(f"Fetching merchant IDs from {len(coordinates)} locations...")
+        # Checkpoint journal: every page and detail row is recorded as it arrives
+        journal = scraper_core.ScrapeJournal(journal_path, category)
+        if resume:
+            print_info(f"Resuming from {journal_path}: {len(journal.merchant_ids())} IDs discovered, "
+                       f"{len(journal.completed_locations())} locations done, "
+                       f"{len(journal.pending_merchant_ids())} merchants awaiting details")
+        else:
+            journal.reset()
+
+        # Detail cache shared across runs and categories: fresh rows skip the network
+        if cache_ttl is None:
+            cache_ttl = scraper_core.DEFAULT_CACHE_TTL
+        if cache_max_entries is None:
+            cache_max_entries = scraper_core.DEFAULT_CACHE_MAX_ENTRIES
+        cache = scraper_core.DetailCache(cache_path, cache_ttl, cache_max_entries) if cache_ttl > 0 else None
+
+        # Rows are streamed to the output file as they complete instead of being held in memory
+        if not delta:
+            sink_options = {'flush_interval': flush_interval} if flush_interval is not None else {}
+            if workbook is not None:
+                sink = workbook.sheet(category.upper(), scraper_core.output_columns(), **sink_options)
+            else:
+                sink = scraper_core.open_result_sink(category, fmt=output_format, **sink_options)
+            print_info(f"Writing results to {sink.path} as they arrive")
+        carried_over = 0
+        reused = 0
+        fetched = 0
+
+        if resume:
+            # Rows fetched by earlier runs live only in the journal
+            for _, row in journal.detail_items():
+                if sink:
+                    sink.write(row)
+                carried_over += 1
+
+        def on_cache_hit(merchant_id, row):
+            nonlocal reused
+            journal.save_detail(merchant_id, row)
+            if sink:
+                sink.write(row)
+            reused += 1
+
+        def on_result(merchant_id, row):
+            nonlocal fetched
+            journal.save_detail(merchant_id, row)
+            if cache:
+                cache.put(merchant_id, row)
+            if sink:
+                sink.write(row)
+            fetched += 1
+
+        # Discovery cache keyed by category and geohash cell
+        if discovery_cache_ttl is None:
+            discovery_cache_ttl = scraper_core.DEFAULT_DISCOVERY_CACHE_TTL
+        if discovery_cache_ttl > 0:
+            # In delta mode every location is walked (a TTL of 0 never serves), but the walks still refresh the cache
+            discovery_cache = scraper_core.DiscoveryCache(discovery_cache_path, 0 if delta else discovery_cache_ttl)
+
+        # Step 3.1: Discover merchant IDs; details start as soon as the first IDs arrive
+        print_info(f"Fetching merchant IDs from {len(coordinates)} locations and their details as they arrive...")
         all_merchant_ids = []
-
-        for idx, (lat, lon) in enumerate(coordinates, 1):
-            print(f"   [{idx}/{len(coordinates)}] Location ({lat}, {lon})...", end='\r')
-            merchant_ids = scraper_core.fetch_merchant_ids_from_location(
-                category,
-                lat,
-                lon,
+        merchant_ids = scraper_core.stream_merchant_ids_from_locations(
+            category,
+            coordinates,
+            headers,
+            max_retries,
+            max_workers=discovery_workers,
+            queue_size=queue_size,
+            discovered=all_merchant_ids,
+            journal=journal,
+            cache=discovery_cache,
+            revalidate=revalidate and not delta
+        )
+        if cache and not delta:
+            # Delta mode compares against live data: cached rows are refreshed, never reused
+            merchant_ids = cache.skip_cached(merchant_ids, on_cache_hit, required_columns=extra_fields)
+        if refresher:
+            # Started on the first ID, once the detail workers have been forked
+            merchant_ids = refresher.start_with(merchant_ids)
+
+        # Step 3.2: Fetch detailed information (pipelined with discovery)
+        if batch_size is None:
+            batch_size = scraper_core.DEFAULT_BATCH_SIZE
+        if engine == 'async':
+            scraper_core.fetch_all_merchant_details_concurrent(
+                merchant_ids,
+                default_coord,
                 headers,
-                max_retries
+                concurrency=concurrency,
+                on_result=on_result,
+                batch_size=batch_size,
+                collect=False
+            )
+        else:
+            scraper_core.fetch_all_merchant_details(
+                merchant_ids,
+                default_coord,
+                headers,
+                num_workers=workers,
+                pool_size=pool_size,
+                http_retries=http_retries,
+                on_result=on_result,
+                batch_size=batch_size,
+                collect=False
             )
-            all_merchant_ids.extend(merchant_ids)
-
-        # Deduplicate
-        all_merchant_ids = list(set(all_merchant_ids))
-        print(f"\n")
-        print_success(f"Found {len(all_merchant_ids)} unique merchants")
         print()
-
-        # Step 3.2: Fetch detailed information
-        print_info("Fetching detailed merchant information (parallel processing)...")
-        merchant_data = scraper_core.fetch_all_merchant_details(
-            all_merchant_ids,
-            default_coord,
-            headers,
-            num_workers=3
-        )
-        print_success(f"Retrieved details for {len(merchant_data)} merchants")
+        print_success(f"Found {len(all_merchant_ids)} unique merchants")
+        if discovery_cache:
+            print_success(f"Used the {discovery_cache.summary()}")
+            discovery_cache.close()
+        print_success(f"Retrieved details for {fetched} merchants")
+        if refresher:
+            refresher.stop()
+        if header_pool and len(header_pool) > 1:
+            print_success(f"Used {header_pool.summary()}")
+        if refresher and refresher.refreshes:
+            print_success(f"Refreshed expired sessions {refresher.refreshes} time(s) during the run")
+        sessions_lost = header_pool is not None and not header_pool.live()
+        if sessions_lost:
+            print_error("Every session expired and could not be refreshed: the results below are incomplete")
+        if cache:
+            if not delta:
+                print_success(f"Reused {reused} merchants from the {cache.summary()}")
+            cache.close()
+        if resume:
+            print_success(f"{carried_over + reused + fetched} merchants with details in total")
+
+        # Change detection against the previous delta run. It holds both states in memory,
+        # so full exports skip it and keep their constant-memory streaming.
+        if delta:
+            delta_state = scraper_core.DeltaState(state_path)
+            changes, state = scraper_core.compute_delta(
+                delta_state.load(category), journal.detail_items(), all_merchant_ids
+            )
+            delta_state.save(category, state)
+            delta_state.close()
+            print_success(f"Since the previous delta run: {len(changes.new)} new, {len(changes.changed)} changed, "
+                          f"{len(changes.removed)} removed, {changes.unchanged} unchanged")
+        journal.close()
         print()
 
-        # Step 3.3: Export to CSV
-        print_info("Generating CSV file...")
-        output_file = scraper_core.export_to_csv(merchant_data, category)
-        print_success(f"CSV generated: {output_file}")
+        # Step 3.3: Export results
+        label = 'CSV' if delta else {'csv': 'CSV', 'parquet': 'Parquet', 'feather': 'Feather', 'xlsx': 'Excel'}[output_format]
+        print_info(f"Generating {label} file...")
+        if delta:
+            output_file = scraper_core.export_delta_csv(changes, category)
+        else:
+            sink.close()
+            output_file = sink.path
+            if workbook is not None:
+                output_file += f" (sheet {category.upper()}, saved after the last category)"
+        print_success(f"{label} generated: {output_file}")
         print()
 
-        return True
+        return not sessions_lost
 
     except ImportError:
         print_error("Could not import scraper_core")
@@ -289,6 +551,20 @@ def run_scraper(category, coordinates_data, headers_data):
         import traceback
         traceback.print_exc()
         return False
+    finally:
+        if refresher:
+            refresher.stop()
+        # A failed or interrupted run still leaves a readable file with every row received so far
+        if sink is not None and not sink.closed:
+            try:
+                sink.close()
+                print_info(f"Rows received so far were saved to {sink.path}")
+            except Exception as e:
+                print_error(f"Could not finish {sink.path}: {e}")
+        # SQLite stores are closed (checkpointing their WAL) on failure too; closing twice is harmless
+        for store in (journal, cache, discovery_cache):
+            if store is not None:
+                store.close()
 
 
 def main():
@@ -309,15 +585,20 @@ Examples:
   python run_scraper.py --category HOME_FOOD_DELIVERY
   python run_scraper.py --category MERCADO_BEBIDAS --skip-map
   python run_scraper.py --category HOME_MERCADO_BR --skip-map --skip-headers
+  python run_scraper.py --engine pool
+  python run_scraper.py --skip-map --skip-headers --resume
+  python run_scraper.py --category MERCADO_BEBIDAS MERCADO_FARMACIA --format xlsx
+  python run_scraper.py --sessions 4 --rps 10
         """
     )
 
     parser.add_argument(
         '--category',
         type=str,
-        default='HOME_FOOD_DELIVERY',
+        nargs='+',
+        default=['HOME_FOOD_DELIVERY'],
         choices=list(AVAILABLE_CATEGORIES.keys()),
-        help='Category to scrape (default: HOME_FOOD_DELIVERY)'
+        help='Category or categories to scrape, one after another (default: HOME_FOOD_DELIVERY)'
     )
 
     parser.add_argument(
@@ -329,7 +610,161 @@ Examples:
     parser.add_argument(
         '--skip-headers',
         action='store_true',
-        help='Skip header capture and use existing captured_headers.json'
+        help='Reuse captured_headers.json when it still works, even with fewer sessions than --sessions'
+    )
+
+    parser.add_argument(
+        '--recapture',
+        action='store_true',
+        help='Always capture new headers in the browser instead of validating the cached ones'
+    )
+
+    parser.add_argument(
+        '--engine',
+        type=str,
+        default='async',
+        choices=['async', 'pool'],
+        help='Detail fetch engine: asyncio or multiprocessing pool (default: async)'
+    )
+
+    parser.add_argument(
+        '--concurrency',
+        type=int,
+        default=100,
+        help='Upper bound on concurrent detail requests for the async engine (default: 100)'
+    )
+
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=8,
+        help='Upper bound on worker processes for the pool engine (default: 8)'
+    )
+
+    parser.add_argument(
+        '--pool-size',
+        type=int,
+        default=None,
+        help='Pooled keep-alive connections per HTTP session (default: 10)'
+    )
+
+    parser.add_argument(
+        '--http-retries',
+        type=int,
+        default=None,
+        help='Transport-level retries for failed connection attempts (default: 2)'
+    )
+
+    parser.add_argument(
+        '--discovery-workers',
+        type=int,
+        default=8,
+        help='Locations fetched concurrently during discovery (default: 8)'
+    )
+
+    parser.add_argument(
+        '--rps',
+        type=float,
+        default=None,
+        help='Requests per second per host, shared by discovery and details; per session with --sessions (default: 20)'
+    )
+
+    parser.add_argument(
+        '--sessions',
+        type=int,
+        default=1,
+        help='Independent iFood sessions to capture and spread requests across, each with its own budget (default: 1)'
+    )
+
+    parser.add_argument(
+        '--session-strategy',
+        type=str,
+        default='round-robin',
+        choices=['round-robin', 'least-loaded'],
+        help='How each request picks a session when several are captured (default: round-robin)'
+    )
+
+    parser.add_argument(
+        '--queue-size',
+        type=int,
+        default=1000,
+        help='Discovered merchant IDs buffered ahead of the detail workers (default: 1000)'
+    )
+
+    parser.add_argument(
+        '--resume',
+        action='store_true',
+        help='Continue an interrupted run from the checkpoint journal instead of starting over'
+    )
+
+    parser.add_argument(
+        '--journal',
+        type=str,
+        default='scrape_journal.db',
+        help='Checkpoint journal file (default: scrape_journal.db)'
+    )
+
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=24,
+        help='Hours a cached merchant detail row is reused across runs and categories; 0 disables the cache (default: 24)'
+    )
+
+    parser.add_argument(
+        '--cache-size',
+        type=int,
+        default=None,
+        help='Merchant detail rows kept in the cache before the oldest are evicted (default: 200000)'
+    )
+
+    parser.add_argument(
+        '--discovery-cache-ttl',
+        type=float,
+        default=6,
+        help='Hours a location\'s merchant IDs are reused instead of re-walking its feed; 0 disables (default: 6)'
+    )
+
+    parser.add_argument(
+        '--revalidate',
+        action='store_true',
+        help='For expired discovery cache entries, fetch only the first page and reuse the rest if it is unchanged'
+    )
+
+    parser.add_argument(
+        '--extra-fields',
+        type=str,
+        default='',
+        help='Comma-separated GraphQL fields to add as CSV columns, e.g. merchantExtra.shortId,merchant.slug'
+    )
+
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=None,
+        help='Maximum merchants per detail request, tuned automatically below it; 1 disables batching (default: 20)'
+    )
+
+    parser.add_argument(
+        '--delta',
+        action='store_true',
+        help='Write only merchants that are new, changed or removed since the previous --delta run'
+    )
+
+    parser.add_argument(
+        '--flush-interval',
+        type=float,
+        default=None,
+        help='Seconds between writes of completed merchants to the output file (default: 5 for CSV, 30 otherwise)'
+    )
+
+    parser.add_argument(
+        '--format',
+        type=str,
+        default='csv',
+        choices=['csv', 'parquet', 'feather', 'xlsx'],
+        help='Output format; parquet and feather are typed columnar files and need pyarrow; '
+             'xlsx puts several categories in one workbook (default: csv)'
     )
 
     args = parser.parse_args()
@@ -344,13 +779,50 @@ Examples:
         sys.exit(1)
 
     # Step 2: Capture headers
-    headers_data = capture_headers(skip_headers=args.skip_headers)
+    headers_data = capture_headers(skip_headers=args.skip_headers, sessions=args.sessions, recapture=args.recapture)
     if not headers_data:
         print_error("Failed to capture headers. Exiting.")
         sys.exit(1)
 
+    # Several categories in xlsx share one workbook, one sheet each
+    workbook = None
+    if args.format == 'xlsx' and len(args.category) > 1 and not args.delta:
+        import scraper_core
+        workbook = scraper_core.XlsxWorkbook(Path.cwd() / "RESULTADO IFOOD.xlsx")
+
     # Step 3: Run scraper
-    success = run_scraper(args.category, coordinates_data, headers_data)
+    try:
+        success = all([run_scraper(
+            category,
+            coordinates_data,
+            headers_data,
+            engine=args.engine,
+            concurrency=args.concurrency,
+            workers=args.workers,
+            pool_size=args.pool_size,
+            http_retries=args.http_retries,
+            discovery_workers=args.discovery_workers,
+            requests_per_second=args.rps,
+            queue_size=args.queue_size,
+            resume=args.resume,
+            journal_path=args.journal,
+            cache_ttl=args.cache_ttl * 3600,
+            cache_max_entries=args.cache_size,
+            discovery_cache_ttl=args.discovery_cache_ttl * 3600,
+            revalidate=args.revalidate,
+            extra_fields=[field.strip() for field in args.extra_fields.split(',') if field.strip()],
+            batch_size=args.batch_size,
+            delta=args.delta,
+            flush_interval=args.flush_interval,
+            output_format=args.format,
+            workbook=workbook,
+            session_strategy=args.session_strategy
+        ) for category in args.category])
+    finally:
+        # Saved even when a category fails or the run is interrupted, so the sheets written so far stay readable
+        if workbook is not None:
+            workbook.close()
+            print_success(f"Excel workbook generated: {workbook.path}")
 
     # Final summary
     print("\n" + "=" * 60)
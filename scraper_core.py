@@ -6,14 +6,28 @@ It provides reusable functions for fetching merchant data from iFood's API.
 """
 
 import time
+import io
+import csv
 import json
+import hashlib
+import random
+import asyncio
 import requests
-import pandas as pd
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import warnings
+import queue
+import sqlite3
+import threading
+import multiprocessing
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 from pathlib import Path
-from typing import List, Tuple, Dict, Optional
-from multiprocessing import Pool, Manager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, List, NamedTuple, Tuple, Dict, Optional, Iterable, Iterator, Sized
+from multiprocessing import Pool
 
 warnings.filterwarnings("ignore", category=urllib3.exceptions.InsecureRequestWarning)
 
@@ -48,6 +62,37 @@ except ImportError:
         def __exit__(self, *args):
             print()  # New line after progress
 
+# Optional async HTTP client for the asyncio detail engine
+try:
+    import aiohttp
+    HAS_AIOHTTP = True
+except ImportError:
+    HAS_AIOHTTP = False
+
+# Optional fast JSON decoder
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# Optional columnar output (Parquet / Arrow IPC)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Optional xlsx output
+try:
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+    HAS_OPENPYXL = True
+except ImportError:
+    HAS_OPENPYXL = False
+
 # Category structure: Maps category name to (section_idx, card_idx) in API response
 CATEGORY_STRUCTURE = {
     "HOME_FOOD_DELIVERY": (1, 0),
@@ -58,6 +103,109 @@ CATEGORY_STRUCTURE = {
     "SHOPPING_OFICIAL": (0, 5)
 }
 
+API_HOST = 'cw-marketplace.ifood.com.br'
+API_BASE_URL = f'https://{API_HOST}'
+
+# Connection pool defaults for the shared HTTP session
+DEFAULT_POOL_SIZE = 10
+DEFAULT_HTTP_RETRIES = 2
+
+# Default request budget per host, shared by discovery and detail calls
+DEFAULT_REQUESTS_PER_SECOND = 20.0
+
+# Attempts per request (with capped exponential backoff) for retryable errors;
+# also the cap for larger TENTATIVAS.txt values, which budget whole feeds instead
+DEFAULT_MAX_ATTEMPTS = 4
+BACKOFF_BASE = 0.5
+BACKOFF_CAP = 30.0
+BACKOFF_MAX_EXPONENT = 16
+
+# Discovery results cached per category and geohash cell (see DiscoveryCache)
+DEFAULT_DISCOVERY_CACHE_TTL = 6 * 3600
+DEFAULT_GEOHASH_PRECISION = 7  # cells of about 150 m x 150 m
+
+# Merchant details cached across runs and categories (see DetailCache)
+DEFAULT_CACHE_TTL = 24 * 3600
+DEFAULT_CACHE_MAX_ENTRIES = 200_000
+
+# One pooled keep-alive session per process (see init_session), and its transport retries
+_session: Optional[requests.Session] = None
+_session_retries: int = DEFAULT_HTTP_RETRIES
+
+# Session bound to the current thread in place of the shared one (see call_with_session)
+_thread_session = threading.local()
+
+# Rate limiter shared by every request in this run (see set_rate_limiter)
+_rate_limiter = None
+
+# Circuit breaker shared by every request in this run (see set_circuit_breaker)
+_circuit_breaker = None
+
+# Captured sessions requests are spread across, if more than one (see set_header_pool)
+_header_pool = None
+
+# Headers that identify a captured iFood session
+SESSION_HEADERS = ('X-Ifood-Session-Id', 'x-client-application-key')
+
+# Consecutive throttled responses after which a pooled session is retired
+DEFAULT_SESSION_MAX_FAILURES = 5
+
+# Bytes of shared memory holding each pooled session's headers (JSON)
+SESSION_SLOT_SIZE = 1024
+
+# Seconds between checks while requests wait for a session to be refreshed
+SESSION_WAIT_INTERVAL = 0.5
+
+# Header captures allowed per run to replace expired sessions (see SessionRefresher)
+DEFAULT_MAX_SESSION_REFRESHES = 3
+
+# Full query the iFood web client sends to the merchant-info endpoint. The
+# scraper requests only what the output needs (see build_details_query);
+# fields for --extra-fields can be picked from here.
+MERCHANT_DETAILS_QUERY = "query ($merchantId: String!) { merchant (merchantId: $merchantId, required: true) { available availableForScheduling contextSetup { catalogGroup context regionGroup } currency deliveryFee { originalValue type value } deliveryMethods { catalogGroup deliveredBy id maxTime minTime mode originalValue priority schedule { now shifts { dayOfWeek endTime interval startTime } timeSlots { availableLoad date endDateTime endTime id isAvailable originalPrice price startDateTime startTime } } subtitle title type value state } deliveryTime distance features id mainCategory { code name } minimumOrderValue name paymentCodes preparationTime priceRange resources { fileName type } slug tags takeoutTime userRating } merchantExtra (merchantId: $merchantId, required: false) { address { city country district latitude longitude state streetName streetNumber timezone zipCode } categories { code description friendlyName } companyCode configs { bagItemNoteLength chargeDifferentToppingsMode nationalIdentificationNumberRequired orderNoteLength } deliveryTime description documents { CNPJ { type value } MCC { type value } } enabled features groups { externalId id name type } id locale mainCategory { code description friendlyName } merchantChain { externalId id name } metadata { ifoodClub { banner { action image priority title } } } minimumOrderValue name phoneIf priceRange resources { fileName type } shifts { dayOfWeek duration start } shortId tags takeoutTime test type userRatingCount } }"
+
+# CSV columns, in output order
+OUTPUT_COLUMNS = [
+    "NOME", "RUA", "NUMERO", "BAIRRO", "CIDADE", "CEP",
+    "LATITUDE", "LONGITUDE", "CNPJ", "PRECO MEDIO",
+    "VALOR MINIMO", "CATEGORIA", "AVALIACAO",
+    "TEMPO ENTREGA", "VALOR ORIGINAL", "SUPER RESTAURANTE"
+]
+
+# GraphQL fields each column is built from (see parse_merchant_record)
+COLUMN_FIELDS = {
+    "NOME": ["merchant.name"],
+    "RUA": ["merchantExtra.address.streetName"],
+    "NUMERO": ["merchantExtra.address.streetNumber"],
+    "BAIRRO": ["merchantExtra.address.district"],
+    "CIDADE": ["merchantExtra.address.city"],
+    "CEP": ["merchantExtra.address.zipCode"],
+    "LATITUDE": ["merchantExtra.address.latitude"],
+    "LONGITUDE": ["merchantExtra.address.longitude"],
+    "CNPJ": ["merchantExtra.documents.CNPJ.value"],
+    "PRECO MEDIO": ["merchant.priceRange"],
+    "VALOR MINIMO": ["merchantExtra.minimumOrderValue"],
+    "CATEGORIA": ["merchant.mainCategory.name"],
+    "AVALIACAO": ["merchant.userRating"],
+    "TEMPO ENTREGA": ["merchant.deliveryTime"],
+    "VALOR ORIGINAL": ["merchant.deliveryFee.originalValue"],
+    "SUPER RESTAURANTE": ["merchantExtra.tags"],
+}
+
+# Root fields of the merchant-info query: (value of their `required` argument, alias prefix in batches)
+DETAILS_ROOTS = {
+    'merchant': ('true', 'm'),
+    'merchantExtra': ('false', 'e'),
+}
+
+# Merchants packed into one aliased GraphQL request (see build_details_query)
+DEFAULT_BATCH_SIZE = 20
+BATCH_MAX_ATTEMPTS = 2  # a failing batch is split rather than retried at length
+
+# Failures that point at the batch itself (one merchant breaking the query), so halving it helps.
+# Congestion (throttling, timeouts, 5xx) fails the batch as is and lets the controllers back off.
+BATCH_SPLIT_ERRORS = ('malformed', 'client')
+
 
 def load_coordinates(filepath='coordinates.json') -> List[Tuple[str, str]]:
     """
@@ -146,6 +294,842 @@ def build_full_headers(captured_headers: dict) -> dict:
     return base_headers
 
 
+def headers_document(sessions: List[dict]) -> Dict:
+    """
+    Build the captured_headers.json document for captured sessions
+
+    The first session is kept at the top level for single-session readers;
+    with more than one, all of them are listed under 'sessions'.
+
+    Args:
+        sessions: Session dicts (X-Ifood-Session-Id, x-client-application-key, timestamp)
+
+    Returns:
+        The headers document
+    """
+    data = dict(sessions[0])
+    if len(sessions) > 1:
+        data['sessions'] = list(sessions)
+    return data
+
+
+def save_headers(sessions: List[dict], filepath='captured_headers.json') -> Dict:
+    """
+    Write captured sessions to a headers JSON file (see headers_document)
+
+    Args:
+        sessions: Session dicts (X-Ifood-Session-Id, x-client-application-key, timestamp)
+        filepath: Path to headers JSON file
+
+    Returns:
+        The document written
+    """
+    data = headers_document(sessions)
+    with open(filepath, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    return data
+
+
+def load_header_sessions(headers_data: dict) -> List[dict]:
+    """
+    List the captured sessions in a captured_headers.json document
+
+    Files written with several sessions keep them under 'sessions'; older
+    single-session files count as one.
+
+    Args:
+        headers_data: Contents of captured_headers.json
+
+    Returns:
+        One dict per session (session headers plus 'timestamp' when known)
+    """
+    sessions = headers_data.get('sessions') or [headers_data]
+    return [session for session in sessions if session.get('X-Ifood-Session-Id')]
+
+
+def create_session(pool_size: int = DEFAULT_POOL_SIZE, retries: int = DEFAULT_HTTP_RETRIES) -> requests.Session:
+    """
+    Create a keep-alive HTTP session with connection pooling
+
+    Args:
+        pool_size: Maximum number of pooled connections per host
+        retries: Transport-level retries for failed connection attempts
+
+    Returns:
+        Configured requests.Session
+    """
+    # Only failed connection attempts are retried here; HTTP errors are
+    # classified and retried with backoff by request_json
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=0,
+        status=0,
+        allowed_methods=None,  # API calls are POSTs but read-only
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+    session = requests.Session()
+    session.verify = False
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def init_session(pool_size: int = DEFAULT_POOL_SIZE, retries: int = DEFAULT_HTTP_RETRIES):
+    """
+    Create this process' shared session (also used as a Pool initializer)
+
+    Args:
+        pool_size: Maximum number of pooled connections per host
+        retries: Transport-level retries for failed connection attempts
+    """
+    global _session, _session_retries
+    _session = create_session(pool_size, retries)
+    _session_retries = retries
+
+
+def get_session() -> requests.Session:
+    """Return the session bound to this thread, else this process' shared session (created on first use)"""
+    session = getattr(_thread_session, 'session', None)
+    if session is not None:
+        return session
+    if _session is None:
+        init_session()
+    return _session
+
+
+def call_with_session(session: Optional[requests.Session], func: Callable, *args):
+    """
+    Call func with this thread's requests sent through `session`
+
+    Lets a group of threads use a session sized for them without replacing
+    the shared one other threads are using. None keeps the shared session.
+    """
+    _thread_session.session = session
+    try:
+        return func(*args)
+    finally:
+        _thread_session.session = None
+
+
+class TokenBucket:
+    """
+    Token bucket refilled at `rate` tokens per second, holding at most `capacity`
+
+    State lives in shared memory, so one bucket can be shared by threads,
+    asyncio tasks and worker processes (pass it through the Pool initializer).
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = multiprocessing.Value('d', self.capacity, lock=False)
+        self._updated = multiprocessing.Value('d', time.monotonic(), lock=False)
+        self._lock = multiprocessing.Lock()
+
+    def try_acquire(self, tokens: float = 1.0) -> float:
+        """
+        Take tokens if available
+
+        Returns:
+            0.0 if the tokens were taken, otherwise seconds until they will be
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            available = min(self.capacity, self._tokens.value + (now - self._updated.value) * self.rate)
+            self._updated.value = now
+            if available >= tokens:
+                self._tokens.value = available - tokens
+                return 0.0
+            self._tokens.value = available
+            return (tokens - available) / self.rate
+
+    def acquire(self, tokens: float = 1.0):
+        """Block until the tokens are taken"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens: float = 1.0):
+        """Wait on the event loop until the tokens are taken"""
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+
+class RateLimiter:
+    """
+    Per-host request budget built from token buckets
+
+    Buckets for the iFood API host and any host in `host_rates` are created
+    up front so they are shared with worker processes. Other hosts get a
+    bucket on first use, local to the process that created it.
+    """
+
+    def __init__(
+        self,
+        requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+        burst: Optional[float] = None,
+        host_rates: Optional[Dict[str, float]] = None
+    ):
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._buckets = {API_HOST: TokenBucket(requests_per_second, burst)}
+        for host, rate in (host_rates or {}).items():
+            self._buckets[host] = TokenBucket(rate, burst)
+
+    def bucket(self, url: str) -> TokenBucket:
+        """Return the bucket for the host of `url`"""
+        host = urlsplit(url).hostname or url
+        if host not in self._buckets:
+            self._buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+        return self._buckets[host]
+
+    def acquire(self, url: str):
+        """Block until a request to `url` fits the budget"""
+        self.bucket(url).acquire()
+
+    async def acquire_async(self, url: str):
+        """Wait on the event loop until a request to `url` fits the budget"""
+        await self.bucket(url).acquire_async()
+
+
+def set_rate_limiter(rate_limiter: Optional[RateLimiter]):
+    """Install the rate limiter used by this process (also done by pool initializers)"""
+    global _rate_limiter
+    _rate_limiter = rate_limiter
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Return this process' rate limiter, creating a default one on first use"""
+    if _rate_limiter is None:
+        set_rate_limiter(RateLimiter())
+    return _rate_limiter
+
+
+# Error kinds worth another attempt after a backoff
+RETRYABLE_ERRORS = ('timeout', 'connection', 'throttled', 'server_error', 'malformed')
+
+
+class RequestError(Exception):
+    """
+    Classified failure of an iFood API request
+
+    kind is one of: 'timeout', 'connection', 'throttled' (429), 'auth'
+    (401, or a 403 about the session), 'server_error' (5xx), 'client'
+    (other 4xx, including firewall 403s)
+    or 'malformed' (body is not the JSON we expect). `retry` overrides
+    whether the kind is retried, e.g. for a body that will fail the same
+    way every time.
+    """
+
+    def __init__(self, kind: str, message: str = '', status_code: Optional[int] = None,
+                 retry_after: Optional[float] = None, retry: Optional[bool] = None):
+        super().__init__(f"{kind}: {message}" if message else kind)
+        self.kind = kind
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.retry = retry
+
+    @property
+    def retryable(self) -> bool:
+        return self.kind in RETRYABLE_ERRORS if self.retry is None else self.retry
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+# Words in a 403 body that mark it as a rejected session rather than a firewall block
+SESSION_ERROR_MARKERS = (b'session', b'token', b'unauthori')
+
+
+def is_session_error(body: bytes) -> bool:
+    """Whether an error body is about the session (a JSON error mentioning it, not an HTML block page)"""
+    text = (body or b'')[:2048].lower()
+    return not text.lstrip().startswith(b'<') and any(marker in text for marker in SESSION_ERROR_MARKERS)
+
+
+def classify_status(status_code: int, retry_after_header: Optional[str] = None,
+                    body: bytes = b'') -> Optional[RequestError]:
+    """
+    Classify an HTTP status code
+
+    A 401 means the session expired. A 403 only counts as 'auth' when its
+    body is about the session (see SESSION_ERROR_MARKERS); otherwise it is
+    a block by a firewall or bot wall, which a new session would not fix.
+
+    Args:
+        status_code: HTTP status
+        retry_after_header: Value of the Retry-After header, if any
+        body: Response body (only inspected for 403s)
+
+    Returns:
+        RequestError for error statuses, None for success
+    """
+    retry_after = parse_retry_after(retry_after_header)
+    if status_code == 429:
+        return RequestError('throttled', 'HTTP 429', status_code, retry_after)
+    if status_code == 401 or (status_code == 403 and is_session_error(body)):
+        return RequestError('auth', f'HTTP {status_code}, session expired or rejected', status_code)
+    if status_code == 403:
+        return RequestError('client', 'HTTP 403, request blocked (not a session error)', status_code)
+    if status_code >= 500:
+        return RequestError('server_error', f'HTTP {status_code}', status_code, retry_after)
+    if status_code >= 400:
+        return RequestError('client', f'HTTP {status_code}', status_code)
+    return None
+
+
+def classify_exception(error: BaseException) -> RequestError:
+    """Classify an exception raised while sending a request or reading its body"""
+    if isinstance(error, RequestError):
+        return error
+    if isinstance(error, (requests.Timeout, asyncio.TimeoutError)):
+        return RequestError('timeout', str(error))
+    if isinstance(error, (requests.ConnectionError, ConnectionError)):
+        return RequestError('connection', str(error))
+    if HAS_AIOHTTP and isinstance(error, aiohttp.ClientConnectionError):
+        return RequestError('connection', str(error))
+    if isinstance(error, (ValueError, KeyError, IndexError, TypeError)):
+        return RequestError('malformed', f'{type(error).__name__}: {error}')
+    if isinstance(error, (requests.RequestException, OSError)):
+        return RequestError('connection', f'{type(error).__name__}: {error}')
+    if HAS_AIOHTTP and isinstance(error, aiohttp.ClientError):
+        return RequestError('connection', f'{type(error).__name__}: {error}')
+    # Anything else came from our side of the exchange (e.g. a parse callback), not the transport
+    return RequestError('malformed', f'{type(error).__name__}: {error}')
+
+
+def parse_body(parse: Callable[[Any], Any], body: Any) -> Any:
+    """
+    Apply a parse callback to a decoded body
+
+    Whatever it raises means the body is malformed. The JSON itself was
+    read fine, so the same body would fail the same way again: the error
+    is not retried (unlike a truncated or undecodable body).
+    """
+    try:
+        return parse(body)
+    except Exception as e:
+        raise RequestError('malformed', f'{type(e).__name__}: {e}', retry=False) from e
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Capped exponential backoff with full jitter for the given attempt (0-based)"""
+    # The exponent is clamped first: 2 ** attempt overflows a float long after the cap is reached
+    return random.uniform(0, min(cap, base * (2 ** min(attempt, BACKOFF_MAX_EXPONENT))))
+
+
+class CircuitBreaker:
+    """
+    Pauses every request when the host is clearly throttling us
+
+    Opens after `threshold` consecutive throttled responses and stays open
+    for `cooldown` seconds. A response with Retry-After opens it at once for
+    the delay the server asked for. While open, wait() blocks all callers.
+    State lives in shared memory so the breaker can be shared with worker
+    processes through the Pool initializer.
+    """
+
+    def __init__(self, threshold: int = 3, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._open_until = multiprocessing.Value('d', 0.0, lock=False)
+        self._failures = multiprocessing.Value('i', 0, lock=False)
+        self._lock = multiprocessing.Lock()
+
+    def remaining(self) -> float:
+        """Seconds until the breaker closes (0 when closed)"""
+        return max(0.0, self._open_until.value - time.monotonic())
+
+    def wait(self):
+        """Block while the breaker is open"""
+        remaining = self.remaining()
+        while remaining > 0:
+            time.sleep(remaining)
+            remaining = self.remaining()
+
+    async def wait_async(self):
+        """Wait on the event loop while the breaker is open"""
+        remaining = self.remaining()
+        while remaining > 0:
+            await asyncio.sleep(remaining)
+            remaining = self.remaining()
+
+    def record_success(self):
+        if self._failures.value:
+            with self._lock:
+                self._failures.value = 0
+
+    def record_failure(self, error: RequestError):
+        if error.kind != 'throttled' and error.retry_after is None:
+            return
+
+        with self._lock:
+            self._failures.value += 1
+            if error.retry_after is None and self._failures.value < self.threshold:
+                return
+            pause = error.retry_after if error.retry_after is not None else self.cooldown
+            until = time.monotonic() + pause
+            if until <= self._open_until.value:
+                return
+            self._open_until.value = until
+            self._failures.value = 0
+
+        print(f"\n   [circuit] host is throttling us ({error}), pausing all requests for {pause:.0f}s", flush=True)
+
+
+def set_circuit_breaker(circuit_breaker: Optional[CircuitBreaker]):
+    """Install the circuit breaker used by this process (also done by pool initializers)"""
+    global _circuit_breaker
+    _circuit_breaker = circuit_breaker
+
+
+def get_circuit_breaker() -> CircuitBreaker:
+    """Return this process' circuit breaker, creating a default one on first use"""
+    if _circuit_breaker is None:
+        set_circuit_breaker(CircuitBreaker())
+    return _circuit_breaker
+
+
+class HeaderPool:
+    """
+    Captured iFood sessions that requests are spread across
+
+    Each session gets its own token bucket of `requests_per_second`, so
+    throughput grows with the number of sessions instead of being capped by
+    one session ID. Requests draw a session round-robin or least-loaded
+    (fewest requests in flight or waiting for budget). A session is retired
+    when it expires (auth failure) or after `max_failures` throttled
+    responses in a row; the last live session is only retired when it has
+    expired. With a SessionRefresher attached, expired sessions are replaced
+    by freshly captured ones and requests wait for that instead of failing.
+    State, including the session headers, lives in shared memory so the pool
+    can be shared with worker processes through the Pool initializer.
+    """
+
+    STRATEGIES = ('round-robin', 'least-loaded')
+
+    # Values of _retired
+    LIVE, THROTTLED, EXPIRED = 0, 1, 2
+
+    def __init__(self, sessions: List[dict], requests_per_second: float = DEFAULT_REQUESTS_PER_SECOND,
+                 strategy: str = 'round-robin', max_failures: int = DEFAULT_SESSION_MAX_FAILURES):
+        """
+        Args:
+            sessions: Captured sessions (see load_header_sessions)
+            requests_per_second: Request budget of each session
+            strategy: 'round-robin' or 'least-loaded'
+            max_failures: Consecutive throttled responses that retire a session
+        """
+        if not sessions:
+            raise ValueError("HeaderPool needs at least one captured session")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown session strategy {strategy!r} (expected one of {', '.join(self.STRATEGIES)})")
+
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self._slots = [multiprocessing.Array('c', SESSION_SLOT_SIZE, lock=False) for _ in sessions]
+        self._versions = multiprocessing.Array('i', len(sessions), lock=False)
+        self._cache: Dict[int, Tuple[int, dict]] = {}  # per process: index -> (version, session)
+        self._buckets = [TokenBucket(requests_per_second) for _ in sessions]
+        self._in_flight = multiprocessing.Array('i', len(sessions), lock=False)
+        self._requests = multiprocessing.Array('i', len(sessions), lock=False)
+        self._failures = multiprocessing.Array('i', len(sessions), lock=False)
+        self._retired = multiprocessing.Array('b', len(sessions), lock=False)
+        self._refreshable = multiprocessing.Value('b', 0, lock=False)
+        self._next = multiprocessing.Value('i', 0, lock=False)
+        self._lock = multiprocessing.Lock()
+        for index, session in enumerate(sessions):
+            self._store(index, session)
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def _store(self, index: int, session: dict):
+        kept = {key: session[key] for key in SESSION_HEADERS + ('timestamp',) if key in session}
+        self._slots[index].value = json.dumps(kept).encode('utf-8')
+        self._versions[index] += 1
+
+    def session(self, index: int) -> dict:
+        """Session `index` as captured (session headers plus 'timestamp' when known)"""
+        version = self._versions[index]
+        cached = self._cache.get(index)
+        if cached is None or cached[0] != version:
+            cached = (version, json.loads(self._slots[index].value))
+            self._cache[index] = cached
+        return cached[1]
+
+    def sessions(self) -> List[dict]:
+        """Every session, retired ones included"""
+        return [self.session(index) for index in range(len(self))]
+
+    def headers(self, index: int) -> dict:
+        """Headers identifying session `index`"""
+        return {key: value for key, value in self.session(index).items() if key in SESSION_HEADERS}
+
+    def live(self) -> int:
+        """Number of sessions not retired"""
+        return sum(1 for retired in self._retired if retired == self.LIVE)
+
+    def expired(self) -> List[int]:
+        """Indexes of sessions retired because they expired"""
+        return [index for index in range(len(self)) if self._retired[index] == self.EXPIRED]
+
+    def recoverable(self) -> bool:
+        """Whether a request can still get a session, now or after a refresh"""
+        return self.live() > 0 or bool(self._refreshable.value and self.expired())
+
+    def set_refreshable(self, refreshable: bool):
+        """Let requests wait for expired sessions to be replaced (see SessionRefresher)"""
+        self._refreshable.value = int(refreshable)
+
+    def replace(self, index: int, session: dict):
+        """Put a freshly captured session in slot `index` and bring it back into rotation"""
+        with self._lock:
+            self._store(index, session)
+            self._failures[index] = 0
+            self._retired[index] = self.LIVE
+
+    def _pick(self) -> Optional[int]:
+        with self._lock:
+            live = [index for index in range(len(self)) if self._retired[index] == self.LIVE]
+            if not live:
+                if self._refreshable.value and self.expired():
+                    return None
+                raise RequestError('auth', 'every captured session has been retired')
+            if self.strategy == 'least-loaded':
+                index = min(live, key=lambda i: (self._in_flight[i], self._requests[i]))
+            else:
+                index = live[self._next.value % len(live)]
+                self._next.value += 1
+            self._in_flight[index] += 1
+            return index
+
+    def checkout(self) -> Tuple[int, dict]:
+        """
+        Pick a session and block until its budget allows a request
+
+        While every session is waiting to be refreshed, blocks until one is.
+
+        Returns:
+            (session index for release(), session headers to send)
+
+        Raises:
+            RequestError: 'auth' when every session has been retired for good
+        """
+        index = self._pick()
+        while index is None:
+            time.sleep(SESSION_WAIT_INTERVAL)
+            index = self._pick()
+        self._buckets[index].acquire()
+        return index, self.headers(index)
+
+    async def checkout_async(self) -> Tuple[int, dict]:
+        """Event-loop version of checkout"""
+        index = self._pick()
+        while index is None:
+            await asyncio.sleep(SESSION_WAIT_INTERVAL)
+            index = self._pick()
+        await self._buckets[index].acquire_async()
+        return index, self.headers(index)
+
+    def release(self, index: int, error: Optional[RequestError] = None):
+        """Report how a request made with session `index` went"""
+        with self._lock:
+            self._in_flight[index] -= 1
+            self._requests[index] += 1
+            if error is None or error.kind not in ('auth', 'throttled'):
+                self._failures[index] = 0
+                return
+            self._failures[index] += 1
+            if self._retired[index] != self.LIVE:
+                return
+            if error.kind != 'auth' and (self._failures[index] < self.max_failures or self.live() == 1):
+                return
+            self._retired[index] = self.EXPIRED if error.kind == 'auth' else self.THROTTLED
+
+        print(f"\n   [sessions] retiring session {index + 1} ({error}), {self.live()} of {len(self)} left", flush=True)
+
+    def summary(self) -> str:
+        """One-line report of requests per session"""
+        counts = ', '.join(
+            f"{self._requests[index]}{' (retired)' if self._retired[index] != self.LIVE else ''}"
+            for index in range(len(self))
+        )
+        return f"{len(self)} sessions ({self.strategy}), {self.live()} live; requests per session: {counts}"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_cache'] = {}
+        return state
+
+
+class SessionRefresher:
+    """
+    Replaces expired sessions of a HeaderPool in the background
+
+    A thread in the parent process watches the pool; when a session expires
+    it calls `capture` with the expired slot's index (e.g. a headless
+    capture_headers_automated run on that slot's browser profile) and puts
+    the new session in the slot. Requests that found no
+    live session wait in HeaderPool.checkout meanwhile, then replay with the
+    new headers, so the run keeps its progress. After `max_refreshes`
+    captures, or when a capture fails, expired sessions stay retired and
+    requests that need them fail with 'auth'.
+    """
+
+    def __init__(self, header_pool: HeaderPool, capture: Callable[[int], Optional[dict]],
+                 max_refreshes: int = DEFAULT_MAX_SESSION_REFRESHES,
+                 on_refresh: Optional[Callable[[HeaderPool], None]] = None):
+        """
+        Args:
+            header_pool: Pool whose expired sessions are replaced
+            capture: Called with the expired slot's index; returns a freshly
+                     captured session dict, or None/{} on failure. It must not
+                     write the headers file: on_refresh saves the whole pool
+            max_refreshes: Captures allowed during the run
+            on_refresh: Called with the pool after every replacement (e.g. to save it)
+        """
+        self.header_pool = header_pool
+        self.capture = capture
+        self.max_refreshes = max_refreshes
+        self.on_refresh = on_refresh
+        self.captures = 0
+        self.refreshes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> 'SessionRefresher':
+        """Start watching the pool"""
+        self.header_pool.set_refreshable(True)
+        self._thread = threading.Thread(target=self._run, name='session-refresher', daemon=True)
+        self._thread.start()
+        return self
+
+    def start_with(self, items: Iterable) -> Iterator:
+        """
+        Yield from items, starting to watch the pool on the first item
+
+        Like the discovery thread of stream_merchant_ids_from_locations, the
+        refresher thread starts only when the consumer first pulls from the
+        iterator, i.e. after fetch_all_merchant_details has forked its
+        worker processes, so no thread exists at fork time.
+
+        Args:
+            items: Iterable handed to the detail fetchers (e.g. merchant IDs)
+        """
+        self.start()
+        yield from items
+
+    def stop(self):
+        """Stop watching; expired sessions are no longer replaced"""
+        self._stop.set()
+        self.header_pool.set_refreshable(False)
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _run(self):
+        while not self._stop.wait(SESSION_WAIT_INTERVAL):
+            expired = self.header_pool.expired()
+            if expired and not self._refresh(expired[0]):
+                self.header_pool.set_refreshable(False)
+                return
+
+    def _refresh(self, index: int) -> bool:
+        if self.captures >= self.max_refreshes:
+            print(f"\n   [sessions] session {index + 1} expired and the refresh limit ({self.max_refreshes}) "
+                  f"was reached", flush=True)
+            return False
+        self.captures += 1
+
+        print(f"\n   [sessions] session {index + 1} expired, capturing a new one in the background...", flush=True)
+        try:
+            session = self.capture(index)
+        except Exception as e:
+            print(f"\n   [sessions] header refresh failed: {e}", flush=True)
+            session = None
+        if not session or not session.get('X-Ifood-Session-Id'):
+            print(f"\n   [sessions] could not capture a new session; requests needing one will fail", flush=True)
+            return False
+
+        self.header_pool.replace(index, session)
+        self.refreshes += 1
+        print(f"\n   [sessions] session {index + 1} refreshed, resuming its requests", flush=True)
+        if self.on_refresh:
+            try:
+                self.on_refresh(self.header_pool)
+            except Exception as e:
+                print(f"\n   [sessions] could not save the refreshed session: {e}", flush=True)
+        return True
+
+
+def set_header_pool(header_pool: Optional[HeaderPool]):
+    """Install the session pool used by this process (also done by pool initializers); None sends the caller's headers"""
+    global _header_pool
+    _header_pool = header_pool
+
+
+def get_header_pool() -> Optional[HeaderPool]:
+    """Return this process' session pool, if one is installed"""
+    return _header_pool
+
+
+def api_post(url: str, headers: dict, payload: dict, timeout: float = 30) -> requests.Response:
+    """
+    POST to the iFood API through the shared session and rate limiter
+
+    Args:
+        url: Request URL
+        headers: Request headers
+        payload: JSON body
+        timeout: Request timeout in seconds
+
+    Returns:
+        requests.Response
+    """
+    get_rate_limiter().acquire(url)
+    return get_session().post(url, headers=headers, json=payload, timeout=timeout)
+
+
+def probe_headers(captured_headers: dict, latitude: str = '-23.5505', longitude: str = '-46.6333',
+                  timeout: float = 10) -> Optional[RequestError]:
+    """
+    Check that captured headers still work with one minimal request
+
+    Sends a single home request for one merchant (size=1), without retries
+    and without any installed session pool, so it costs one call instead of
+    a browser launch.
+
+    Args:
+        captured_headers: Dict with X-Ifood-Session-Id and x-client-application-key
+        latitude: Latitude for the request (default: São Paulo)
+        longitude: Longitude for the request
+        timeout: Request timeout in seconds
+
+    Returns:
+        None when the request succeeded, otherwise its RequestError; kinds in
+        DEAD_SESSION_ERRORS mean the session is no longer accepted
+    """
+    url = f'{API_BASE_URL}/v2/home?latitude={latitude}&longitude={longitude}&channel=IFOOD&size=1&alias=HOME_FOOD_DELIVERY'
+    try:
+        response = api_post(url, build_full_headers(captured_headers), HOME_PAYLOAD, timeout=timeout)
+        error = classify_status(response.status_code, response.headers.get('Retry-After'), response.content)
+        if error is None:
+            decode_json(response.content)
+    except Exception as e:
+        error = classify_exception(e)
+    return error
+
+
+def request_json(
+    url: str,
+    headers: dict,
+    payload: dict,
+    parse: Optional[Callable[[Any], Any]] = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    trace: Optional[dict] = None
+) -> Any:
+    """
+    POST to the iFood API and decode the JSON body, retrying where it makes sense
+
+    The body is decoded exactly once (see decode_json) and handed to `parse`,
+    which should pull out only the fields the caller needs.
+
+    Failures are classified (see RequestError). Timeouts, connection resets,
+    429s, 5xx and malformed bodies are retried with capped exponential
+    backoff and jitter, honouring Retry-After. Auth and other client errors
+    fail at once. Throttling feeds the shared circuit breaker. When a
+    HeaderPool is installed, every attempt is sent with one of its sessions
+    in place of the session headers in `headers`.
+
+    Args:
+        url: Request URL
+        headers: Request headers
+        payload: JSON body
+        parse: Optional function applied to the decoded body; its exceptions
+               count as malformed responses and are not retried
+        max_attempts: Maximum attempts for retryable errors
+        trace: Optional dict that receives 'errors' (list of RequestError)
+               and 'latency' (seconds of the last attempt)
+
+    Returns:
+        Decoded body, or parse(body) when parse is given
+
+    Raises:
+        RequestError: When the request fails for good
+    """
+    breaker = get_circuit_breaker()
+    header_pool = get_header_pool()
+    errors = []
+    if trace is not None:
+        trace['errors'] = errors
+
+    attempt = 0
+    while True:
+        breaker.wait()
+        request_headers = headers
+        if header_pool is not None:
+            session_index, session_headers = header_pool.checkout()
+            request_headers = {**headers, **session_headers}
+        start = time.monotonic()
+        try:
+            response = api_post(url, request_headers, payload)
+            error = classify_status(response.status_code, response.headers.get('Retry-After'), response.content)
+            if error is None:
+                result = decode_json(response.content)
+                if parse is not None:
+                    result = parse_body(parse, result)
+                breaker.record_success()
+                if header_pool is not None:
+                    header_pool.release(session_index)
+                if trace is not None:
+                    trace['latency'] = time.monotonic() - start
+                return result
+        except Exception as e:
+            error = classify_exception(e)
+
+        if trace is not None:
+            trace['latency'] = time.monotonic() - start
+        errors.append(error)
+        breaker.record_failure(error)
+        if header_pool is not None:
+            header_pool.release(session_index, error)
+            if error.kind == 'auth' and header_pool.recoverable():
+                continue  # that session expired: replay on another (or a refreshed) one, not counted as an attempt
+
+        if not error.retryable or attempt == max_attempts - 1:
+            raise error
+        time.sleep(error.retry_after if error.retry_after is not None else backoff_delay(attempt))
+        attempt += 1
+
+
 def load_retry_attempts(category='HOME_FOOD_DELIVERY') -> int:
     """
     Load retry attempts from TENTATIVAS.txt
@@ -172,12 +1156,99 @@ def load_retry_attempts(category='HOME_FOOD_DELIVERY') -> int:
     return 5  # Default fallback
 
 
+def decode_json(content: bytes) -> Any:
+    """Decode a response body once, with orjson when installed"""
+    if HAS_ORJSON:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+class HomePage(NamedTuple):
+    """The parts of a home feed page that discovery needs"""
+    merchant_ids: List[str]
+    cursor: Optional[str]  # None at the end of the feed
+    section_id: str
+
+
+def parse_home_page(body: dict, section_idx: int, card_idx: int) -> HomePage:
+    """
+    Pull merchant IDs, next cursor and section id out of a decoded home page
+
+    Args:
+        body: Decoded home response
+        section_idx: Index of the category's section
+        card_idx: Index of the merchant list card within the section
+
+    Returns:
+        HomePage
+    """
+    section = body['sections'][section_idx]
+    contents = section['cards'][card_idx]['data']['contents']
+    return HomePage(
+        merchant_ids=[content['id'] for content in contents],
+        cursor=extract_next_cursor(section, card_idx),
+        section_id=str(section['id'])
+    )
+
+
+def extract_next_cursor(section: dict, card_idx: int) -> Optional[str]:
+    """
+    Extract the pagination cursor from a home feed section
+
+    The cursor lives in the action of the card following the merchant list.
+    A missing card or action is the normal end of the feed.
+
+    Args:
+        section: Section object from the home response
+        card_idx: Index of the merchant list card within the section
+
+    Returns:
+        Cursor string, or None when there are no more pages
+    """
+    cards = section.get('cards', [])
+    if card_idx + 1 >= len(cards):
+        return None
+
+    action = (cards[card_idx + 1].get('data') or {}).get('action')
+    if not action or 'cursor=' not in str(action):
+        return None
+
+    return str(action).split('cursor=')[1]
+
+
+# Body of every /v2/home request
+HOME_PAYLOAD = {
+    "supported-headers": ["OPERATION_HEADER"],
+    "supported-cards": [
+        "MERCHANT_LIST", "CATALOG_ITEM_LIST", "CATALOG_ITEM_LIST_V2", "CATALOG_ITEM_LIST_V3",
+        "FEATURED_MERCHANT_LIST", "CATALOG_ITEM_CAROUSEL", "CATALOG_ITEM_CAROUSEL_V2",
+        "CATALOG_ITEM_CAROUSEL_V3", "BIG_BANNER_CAROUSEL", "IMAGE_BANNER",
+        "MERCHANT_LIST_WITH_ITEMS_CAROUSEL", "SMALL_BANNER_CAROUSEL", "NEXT_CONTENT",
+        "MERCHANT_CAROUSEL", "MERCHANT_TILE_CAROUSEL", "SIMPLE_MERCHANT_CAROUSEL", "INFO_CARD",
+        "MERCHANT_LIST_V2", "ROUND_IMAGE_CAROUSEL", "BANNER_GRID", "MEDIUM_IMAGE_BANNER",
+        "MEDIUM_BANNER_CAROUSEL", "RELATED_SEARCH_CAROUSEL", "ADS_BANNER"
+    ],
+    "supported-actions": [
+        "catalog-item", "merchant", "page", "card-content", "last-restaurants",
+        "webmiddleware", "reorder", "search", "groceries", "home-tab"
+    ],
+    "feed-feature-name": "",
+    "faster-overrides": ""
+}
+
+# Probe results that mean the captured headers are no longer accepted
+DEAD_SESSION_ERRORS = ('auth', 'client', 'malformed')
+
+
 def fetch_merchant_ids_from_location(
     category_alias: str,
     latitude: str,
     longitude: str,
     headers: dict,
-    max_retries: int = 5
+    max_retries: int = 5,
+    on_page: Optional[Callable[[HomePage], None]] = None,
+    resume_from: Optional[HomePage] = None,
+    max_pages: Optional[int] = None
 ) -> List[str]:
     """
     Fetch merchant IDs from a single location
@@ -187,73 +1258,69 @@ def fetch_merchant_ids_from_location(
         latitude: Latitude coordinate
         longitude: Longitude coordinate
         headers: Request headers
-        max_retries: Maximum retry attempts for pagination
+        max_retries: Budget of consecutive failed requests for the feed
+                     (TENTATIVAS.txt); each request gets at most
+                     DEFAULT_MAX_ATTEMPTS attempts of it
+        on_page: Optional callback receiving each parsed HomePage
+        resume_from: Optional page whose cursor to continue from (skips the first request)
+        max_pages: Optional limit on pages requested (default: until the feed ends)
 
     Returns:
         List of merchant IDs
     """
     merchant_ids = []
+    pages = 0
 
     try:
-        url = f'https://cw-marketplace.ifood.com.br/v2/home?latitude={latitude}&longitude={longitude}&channel=IFOOD&size=100&alias={category_alias}'
-
-        payload = {
-            "supported-headers": ["OPERATION_HEADER"],
-            "supported-cards": [
-                "MERCHANT_LIST", "CATALOG_ITEM_LIST", "CATALOG_ITEM_LIST_V2", "CATALOG_ITEM_LIST_V3",
-                "FEATURED_MERCHANT_LIST", "CATALOG_ITEM_CAROUSEL", "CATALOG_ITEM_CAROUSEL_V2",
-                "CATALOG_ITEM_CAROUSEL_V3", "BIG_BANNER_CAROUSEL", "IMAGE_BANNER",
-                "MERCHANT_LIST_WITH_ITEMS_CAROUSEL", "SMALL_BANNER_CAROUSEL", "NEXT_CONTENT",
-                "MERCHANT_CAROUSEL", "MERCHANT_TILE_CAROUSEL", "SIMPLE_MERCHANT_CAROUSEL", "INFO_CARD",
-                "MERCHANT_LIST_V2", "ROUND_IMAGE_CAROUSEL", "BANNER_GRID", "MEDIUM_IMAGE_BANNER",
-                "MEDIUM_BANNER_CAROUSEL", "RELATED_SEARCH_CAROUSEL", "ADS_BANNER"
-            ],
-            "supported-actions": [
-                "catalog-item", "merchant", "page", "card-content", "last-restaurants",
-                "webmiddleware", "reorder", "search", "groceries", "home-tab"
-            ],
-            "feed-feature-name": "",
-            "faster-overrides": ""
-        }
-
-        # Initial request
-        response = requests.post(url, headers=headers, json=payload, verify=False, timeout=30)
-        section_idx, card_idx = CATEGORY_STRUCTURE[category_alias]
-
-        # Extract initial IDs
-        for content in response.json()['sections'][section_idx]['cards'][card_idx]['data']['contents']:
-            merchant_ids.append(content['id'])
-
-        # Try to get cursor for pagination
-        try:
-            cursor = str(response.json()['sections'][section_idx]['cards'][card_idx + 1]['data']['action']).split('cursor=')[1]
-        except:
-            return merchant_ids
-
-        section_id = str(response.json()['sections'][section_idx]['id'])
+        url = f'{API_BASE_URL}/v2/home?latitude={latitude}&longitude={longitude}&channel=IFOOD&size=100&alias={category_alias}'
 
-        # Pagination loop
-        retry_count = 0
-        while True:
-            time.sleep(1)  # Rate limiting
-
-            try:
-                paginated_url = f'https://cw-marketplace.ifood.com.br/v2/home?latitude={latitude}&longitude={longitude}&channel=IFOOD&size=100&section={section_id}&cursor={cursor}&alias={category_alias}'
-                response = requests.post(paginated_url, headers=headers, json=payload, verify=False, timeout=30)
-
-                contents = response.json()['sections'][section_idx]['cards'][card_idx]['data']['contents']
-                cursor = str(response.json()['sections'][section_idx]['cards'][card_idx + 1]['data']['action']).split('cursor=')[1]
-                section_id = str(response.json()['sections'][section_idx]['id'])
+        payload = HOME_PAYLOAD
 
-                for content in contents:
-                    merchant_ids.append(content['id'])
-
-                retry_count = 0  # Reset on success
+        section_idx, card_idx = CATEGORY_STRUCTURE[category_alias]
 
-            except:
-                retry_count += 1
-                if retry_count >= max_retries:
-                    break
+        def parse_page(body):
+            return parse_home_page(body, section_idx, card_idx)
+
+        failures = 0  # consecutive failed requests, reset by every page that loads
+
+        def get_page(page_url):
+            # A page that fails for good on a retryable error is requested again
+            # while the feed's budget lasts; anything else ends the feed
+            nonlocal failures
+            while True:
+                trace = {}
+                attempts = max(1, min(DEFAULT_MAX_ATTEMPTS, max_retries - failures))
+                try:
+                    page = request_json(page_url, headers, payload, parse=parse_page, max_attempts=attempts, trace=trace)
+                except RequestError as e:
+                    failures += len(trace.get('errors', [])) or 1
+                    if not e.retryable or failures >= max_retries:
+                        raise
+                    continue
+                failures = 0
+                return page
+
+        # Initial request (no cursor on the first page means the feed fits in one page)
+        if resume_from is not None:
+            page = resume_from
+        else:
+            page = get_page(url)
+            pages += 1
+            merchant_ids.extend(page.merchant_ids)
+            if on_page:
+                on_page(page)
+
+        # Pagination loop: runs until the feed ends (no cursor or no contents)
+        while page.cursor is not None and (max_pages is None or pages < max_pages):
+            paginated_url = f'{API_BASE_URL}/v2/home?latitude={latitude}&longitude={longitude}&channel=IFOOD&size=100&section={page.section_id}&cursor={page.cursor}&alias={category_alias}'
+            page = get_page(paginated_url)
+            pages += 1
+            merchant_ids.extend(page.merchant_ids)
+            if on_page:
+                on_page(page)
+
+            if not page.merchant_ids:
+                break  # Empty page: end of feed
 
         return merchant_ids
 
@@ -262,142 +1329,2110 @@ def fetch_merchant_ids_from_location(
         return merchant_ids
 
 
-def fetch_merchant_details(
-    merchant_id: str,
-    latitude: str,
-    longitude: str,
-    headers: dict
-) -> Optional[Dict]:
+def fetch_merchant_ids_from_locations(
+    category_alias: str,
+    coordinates: List[Tuple[str, str]],
+    headers: dict,
+    max_retries: int = 5,
+    max_workers: int = 8,
+    on_new_ids: Optional[Callable[[List[str]], None]] = None,
+    journal: Optional['ScrapeJournal'] = None,
+    cache: Optional['DiscoveryCache'] = None,
+    revalidate: bool = False
+) -> List[str]:
     """
-    Fetch detailed information for a single merchant
+    Fetch merchant IDs from many locations concurrently
+
+    Locations are paginated in parallel threads that share the process'
+    rate limiter. Every page is merged into the deduplicated set as soon as
+    it arrives, and a line with each location's ID count and timing is
+    printed when it finishes.
+
+    With a journal, every page's IDs and cursor are recorded as they arrive;
+    locations completed in an earlier run are skipped, interrupted ones
+    continue from their last cursor, and IDs already in the journal count
+    as seen.
+
+    With a discovery cache, a location whose geohash cell was walked within
+    the cache TTL is answered from the cache without any request. With
+    `revalidate`, expired entries cost a single request: when the first page
+    still lists the same merchants, the cached tail is reused.
 
     Args:
-        merchant_id: Merchant ID to fetch
-        latitude: Latitude for the request
-        longitude: Longitude for the request
+        category_alias: Category to fetch (e.g., 'HOME_FOOD_DELIVERY')
+        coordinates: List of (latitude, longitude) tuples
         headers: Request headers
+        max_retries: Budget of consecutive failed requests per location feed
+                     (see fetch_merchant_ids_from_location)
+        max_workers: Maximum locations paginated at the same time
+        on_new_ids: Optional callback receiving IDs not seen before, page by page
+                    (called from discovery threads)
+        journal: Optional ScrapeJournal for checkpointing and resume
+        cache: Optional DiscoveryCache shared across runs
+        revalidate: Check expired cache entries against the first page instead of re-walking
 
     Returns:
-        Dictionary with merchant details or None if failed
+        List of unique merchant IDs
     """
-    try:
-        url = f'https://cw-marketplace.ifood.com.br/v1/merchant-info/graphql?latitude={latitude}&longitude={longitude}&channel=IFOOD'
-
-        payload = {
-            "query": "query ($merchantId: String!) { merchant (merchantId: $merchantId, required: true) { available availableForScheduling contextSetup { catalogGroup context regionGroup } currency deliveryFee { originalValue type value } deliveryMethods { catalogGroup deliveredBy id maxTime minTime mode originalValue priority schedule { now shifts { dayOfWeek endTime interval startTime } timeSlots { availableLoad date endDateTime endTime id isAvailable originalPrice price startDateTime startTime } } subtitle title type value state } deliveryTime distance features id mainCategory { code name } minimumOrderValue name paymentCodes preparationTime priceRange resources { fileName type } slug tags takeoutTime userRating } merchantExtra (merchantId: $merchantId, required: false) { address { city country district latitude longitude state streetName streetNumber timezone zipCode } categories { code description friendlyName } companyCode configs { bagItemNoteLength chargeDifferentToppingsMode nationalIdentificationNumberRequired orderNoteLength } deliveryTime description documents { CNPJ { type value } MCC { type value } } enabled features groups { externalId id name type } id locale mainCategory { code description friendlyName } merchantChain { externalId id name } metadata { ifoodClub { banner { action image priority title } } } minimumOrderValue name phoneIf priceRange resources { fileName type } shifts { dayOfWeek duration start } shortId tags takeoutTime test type userRatingCount } }",
-            "variables": {"merchantId": merchant_id}
-        }
-
-        response = requests.post(url, headers=headers, json=payload, verify=False, timeout=30)
-        data = response.json()['data']
-
-        merchant = data.get('merchant', {})
-        merchant_extra = data.get('merchantExtra', {})
-        address = merchant_extra.get('address', {})
-        documents = merchant_extra.get('documents', {})
-        cnpj = documents.get('CNPJ', {})
-
-        # Check for super restaurant tag
-        tags = merchant_extra.get('tags', [])
-        is_super = "SIM" if "SUPER_RESTAURANT" in tags else "NAO"
-
-        # Convert price range
-        price_range = merchant.get('priceRange', '')
-        price_display = {
-            "CHEAPEST": "$",
-            "CHEAP": "$$",
-            "MODERATE": "$$$",
-            "EXPENSIVE": "$$$$",
-            "MOST_EXPENSIVE": "$$$$$"
-        }.get(price_range, price_range)
-
-        return {
-            "NOME": merchant.get('name', ''),
-            "RUA": address.get('streetName', ''),
-            "NUMERO": address.get('streetNumber', ''),
-            "BAIRRO": address.get('district', ''),
-            "CIDADE": address.get('city', ''),
-            "CEP": address.get('zipCode', ''),
-            "LATITUDE": address.get('latitude', ''),
-            "LONGITUDE": address.get('longitude', ''),
-            "CNPJ": cnpj.get('value', ''),
-            "PRECO MEDIO": price_display,
-            "VALOR MINIMO": merchant_extra.get('minimumOrderValue', ''),
-            "CATEGORIA": merchant.get('mainCategory', {}).get('name', ''),
-            "AVALIACAO": merchant.get('userRating', ''),
-            "TEMPO ENTREGA": merchant.get('deliveryTime', ''),
-            "VALOR ORIGINAL": merchant.get('deliveryFee', {}).get('originalValue', ''),
-            "SUPER RESTAURANTE": is_super,
-        }
+    unique_ids = {}  # dict keeps discovery order
+    lock = threading.Lock()
+    total = len(coordinates)
+
+    completed_locations = set()
+    if journal is not None:
+        unique_ids.update(dict.fromkeys(journal.merchant_ids()))
+        completed_locations = journal.completed_locations()
+
+    def merge_page(ids):
+        with lock:
+            new_ids = [mid for mid in dict.fromkeys(ids) if mid not in unique_ids]
+            unique_ids.update(dict.fromkeys(new_ids))
+        if new_ids and on_new_ids:
+            on_new_ids(new_ids)
+        return len(new_ids)
+
+    def timed_fetch(lat, lon):
+        start = time.monotonic()
+        new_count = 0
+        pages = {}  # first and last page seen
+
+        def on_page(page):
+            nonlocal new_count
+            pages.setdefault('first', page)
+            pages['last'] = page
+            if journal is not None:
+                journal.record_page(lat, lon, page)
+            new_count += merge_page(page.merchant_ids)
+
+        def walk(resume_from=None, max_pages=None):
+            return fetch_merchant_ids_from_location(
+                category_alias, lat, lon, headers, max_retries, on_page, resume_from, max_pages
+            )
+
+        resume_from = journal.location_cursor(lat, lon) if journal is not None else None
+        cached = None
+        if cache is not None and resume_from is None:
+            cached = cache.get(category_alias, lat, lon, allow_stale=revalidate)
+        walked = True  # whether `ids` came from a full walk from the top of the feed
+
+        if cached is not None and cached.fresh:
+            # Cached results stand in for the whole feed as one final page
+            ids = cached.merchant_ids
+            on_page(HomePage(ids, None, None))
+            walked = False
+        elif cached is not None:
+            ids = walk(max_pages=1)
+            first = pages.get('first')
+            if first is not None and first.merchant_ids == cached.first_page:
+                ids = cached.merchant_ids
+                on_page(HomePage(ids, None, first.section_id))
+                cache.put(category_alias, lat, lon, cached.first_page, ids)
+                walked = False
+            elif first is not None and first.cursor is not None and first.merchant_ids:
+                ids += walk(resume_from=first)
+        else:
+            ids = walk(resume_from)
 
-    except:
-        return None
+        # The feed ended normally (rather than on an error) when the last page had no cursor or no IDs
+        last_page = pages.get('last')
+        if last_page is not None and (last_page.cursor is None or not last_page.merchant_ids):
+            if journal is not None:
+                journal.complete_location(lat, lon)
+            if cache is not None and walked and resume_from is None:
+                cache.put(category_alias, lat, lon, pages['first'].merchant_ids, ids)
 
+        return ids, new_count, time.monotonic() - start
 
-def worker_fetch_details(params):
-    """Worker function for multiprocessing pool"""
-    merchant_id, latitude, longitude, headers, results_list, counter, lock = params
-    result = fetch_merchant_details(merchant_id, latitude, longitude, headers)
-    if result:
-        results_list.append(result)
+    pending = [(lat, lon) for lat, lon in coordinates if (lat, lon) not in completed_locations]
+    if len(pending) < total:
+        print(f"   Skipping {total - len(pending)} locations completed in a previous run")
 
-    # Update progress counter
-    with lock:
-        counter.value += 1
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(timed_fetch, lat, lon): (lat, lon) for lat, lon in pending}
 
+        for done, future in enumerate(as_completed(futures), total - len(pending) + 1):
+            lat, lon = futures[future]
+            ids, new, elapsed = future.result()
 
-def fetch_all_merchant_details(
-    merchant_ids: List[str],
-    default_coordinates: Tuple[str, str],
+            line = (f"   [{done}/{total}] ({lat}, {lon}): {len(ids)} IDs, {new} new, {elapsed:.1f}s"
+                    f" - {len(unique_ids)} unique so far")
+            print(f"\r{line}".ljust(80))
+
+    return list(unique_ids)
+
+
+def stream_merchant_ids_from_locations(
+    category_alias: str,
+    coordinates: List[Tuple[str, str]],
     headers: dict,
-    num_workers: int = 3
-) -> List[Dict]:
+    max_retries: int = 5,
+    max_workers: int = 8,
+    queue_size: int = 1000,
+    discovered: Optional[List[str]] = None,
+    journal: Optional['ScrapeJournal'] = None,
+    cache: Optional['DiscoveryCache'] = None,
+    revalidate: bool = False
+) -> Iterable[str]:
     """
-    Fetch details for all merchants using parallel processing
+    Generator of new merchant IDs while discovery is still running
+
+    Discovery runs in a background thread (started on the first next()) and
+    pushes each new ID through the dedup set into a bounded queue; the
+    generator yields them as they arrive, so detail fetching can start on
+    the first page. A full queue blocks discovery until details catch up.
 
     Args:
-        merchant_ids: List of merchant IDs to fetch
-        default_coordinates: (lat, lon) tuple for detail requests
+        category_alias: Category to fetch (e.g., 'HOME_FOOD_DELIVERY')
+        coordinates: List of (latitude, longitude) tuples
         headers: Request headers
-        num_workers: Number of parallel workers
-
-    Returns:
-        List of merchant detail dictionaries
+        max_retries: Budget of consecutive failed requests per location feed
+                     (see fetch_merchant_ids_from_location)
+        max_workers: Maximum locations paginated at the same time
+        queue_size: Maximum IDs waiting for a detail worker
+        discovered: Optional list that receives every unique ID once discovery ends
+        journal: Optional ScrapeJournal; IDs it knows but has no details for are
+                 yielded first, then discovery resumes where it stopped
+        cache: Optional DiscoveryCache shared across runs
+        revalidate: Check expired cache entries against the first page instead of re-walking
+
+    Yields:
+        Unique merchant IDs in discovery order
+
+    Raises:
+        Whatever discovery raised (e.g. a journal or cache error), once the IDs
+        found before it have been yielded
     """
-    manager = Manager()
-    results_list = manager.list()
-    counter = manager.Value('i', 0)
-    lock = manager.Lock()
-
-    params_list = [
-        (mid, default_coordinates[0], default_coordinates[1], headers, results_list, counter, lock)
-        for mid in merchant_ids
-    ]
-
-    print(f"   Processing {len(merchant_ids)} merchants with {num_workers} workers...")
-
-    with Pool(processes=num_workers) as pool:
-        # Use imap_unordered for better progress tracking
-        for _ in pool.imap_unordered(worker_fetch_details, params_list):
-            # Print progress (using ASCII for Windows compatibility)
-            current = counter.value
-            total = len(merchant_ids)
-            pct = (current / total) * 100 if total > 0 else 0
-            bar_length = 40
-            filled = int(bar_length * current / total) if total > 0 else 0
-            bar = '#' * filled + '-' * (bar_length - filled)
-            print(f"\r   [{bar}] {current}/{total} ({pct:.1f}%)", end='', flush=True)
-
-    print()  # New line after progress
-    return list(results_list)
+    id_queue = queue.Queue(maxsize=queue_size)
+    finished = object()
 
+    def enqueue(ids):
+        for merchant_id in ids:
+            id_queue.put(merchant_id)
 
-def export_to_csv(data: List[Dict], category: str, output_dir: Path = None) -> str:
+    def produce():
+        try:
+            if journal is not None:
+                enqueue(journal.pending_merchant_ids())
+            ids = fetch_merchant_ids_from_locations(
+                category_alias, coordinates, headers, max_retries, max_workers, on_new_ids=enqueue, journal=journal,
+                cache=cache, revalidate=revalidate
+            )
+            if discovered is not None:
+                discovered.extend(ids)
+        except Exception as e:
+            # Handed to the consumer, so a failed discovery fails the run instead of ending it early
+            id_queue.put(e)
+        finally:
+            id_queue.put(finished)
+
+    # Started lazily so that a process pool can be created before any thread exists
+    threading.Thread(target=produce, daemon=True).start()
+
+    while True:
+        merchant_id = id_queue.get()
+        if merchant_id is finished:
+            return
+        if isinstance(merchant_id, Exception):
+            raise merchant_id
+        yield merchant_id
+
+
+def build_details_url(latitude: str, longitude: str) -> str:
+    """Build the merchant-info GraphQL URL for a coordinate"""
+    return f'{API_BASE_URL}/v1/merchant-info/graphql?latitude={latitude}&longitude={longitude}&channel=IFOOD'
+
+
+def build_details_query(columns: Iterable[str] = OUTPUT_COLUMNS, extra_fields: Iterable[str] = (),
+                        batch_size: int = 1) -> str:
+    """
+    Build the smallest merchant-info query that covers the output columns
+
+    With batch_size > 1 the query fetches that many merchants at once: the
+    root fields of merchant i are aliased m{i} and e{i} and read the $id{i}
+    variable.
+
+    Args:
+        columns: Output columns the rows need (keys of COLUMN_FIELDS)
+        extra_fields: Additional dotted leaf paths to request, e.g.
+                      'merchantExtra.shortId' or 'merchant.deliveryMethods.mode'
+        batch_size: Number of merchants per query
+
+    Returns:
+        GraphQL query string taking a $merchantId variable (or $id0, $id1, ... for batches)
+    """
+    tree = {}
+    paths = [path for column in columns for path in COLUMN_FIELDS[column]] + list(extra_fields)
+    for path in paths:
+        root = path.split('.', 1)[0]
+        if root not in DETAILS_ROOTS or '.' not in path:
+            raise ValueError(f"Field '{path}' must start with one of: {', '.join(DETAILS_ROOTS)}")
+        node = tree
+        for name in path.split('.'):
+            node = node.setdefault(name, {})
+
+    def selection(node):
+        return ' '.join(f'{name} {{ {selection(child)} }}' if child else name for name, child in node.items())
+
+    selections = {root: selection(fields) for root, fields in tree.items()}
+
+    def roots(variable, index=None):
+        fields = []
+        for root, selected in selections.items():
+            required, prefix = DETAILS_ROOTS[root]
+            alias = ''
+            if index is not None:
+                # One missing merchant must not void the whole batch; it is retried on its own
+                alias, required = f'{prefix}{index}: ', 'false'
+            fields.append(f'{alias}{root} (merchantId: ${variable}, required: {required}) {{ {selected} }}')
+        return ' '.join(fields)
+
+    if batch_size == 1:
+        return f'query ($merchantId: String!) {{ {roots("merchantId")} }}'
+
+    variables = ', '.join(f'$id{i}: String!' for i in range(batch_size))
+    body = ' '.join(roots(f'id{i}', i) for i in range(batch_size))
+    return f'query ({variables}) {{ {body} }}'
+
+
+# Extra fields requested on top of the output columns (see set_detail_fields)
+_detail_fields: Tuple[str, ...] = ()
+_details_query = build_details_query()
+_batch_queries: Dict[int, str] = {}  # batch size -> query, built on first use
+
+
+def set_detail_fields(extra_fields: Iterable[str] = ()):
+    """Request extra dotted fields with every merchant; each becomes a column named by its path"""
+    global _detail_fields, _details_query
+    _details_query = build_details_query(OUTPUT_COLUMNS, extra_fields)
+    _detail_fields = tuple(extra_fields)
+    _batch_queries.clear()
+
+
+def get_detail_fields() -> Tuple[str, ...]:
+    """Extra fields currently requested (see set_detail_fields)"""
+    return _detail_fields
+
+
+def build_details_payload(merchant_id: str) -> dict:
+    """Build the GraphQL payload for a single merchant"""
+    return {
+        "query": _details_query,
+        "variables": {"merchantId": merchant_id}
+    }
+
+
+def build_batch_details_payload(merchant_ids: List[str]) -> dict:
+    """Build the aliased GraphQL payload for several merchants"""
+    size = len(merchant_ids)
+    if size not in _batch_queries:
+        _batch_queries[size] = build_details_query(OUTPUT_COLUMNS, _detail_fields, batch_size=size)
+    return {
+        "query": _batch_queries[size],
+        "variables": {f"id{i}": merchant_id for i, merchant_id in enumerate(merchant_ids)}
+    }
+
+
+def extract_field(data: Any, path: str) -> Any:
+    """
+    Read a dotted path from a response, mapping over lists along the way
+
+    Args:
+        data: The 'data' field of the GraphQL response
+        path: Dotted field path, e.g. 'merchant.deliveryMethods.mode'
+
+    Returns:
+        The value, a list of values for paths crossing lists, or '' when missing
+    """
+    name, _, rest = path.partition('.')
+    if isinstance(data, list):
+        return [extract_field(item, path) for item in data]
+    if not isinstance(data, dict) or data.get(name) is None:
+        return ''
+    return extract_field(data[name], rest) if rest else data[name]
+
+
+# Display values of the priceRange codes
+PRICE_RANGE_DISPLAY = {
+    "CHEAPEST": "$",
+    "CHEAP": "$$",
+    "MODERATE": "$$$",
+    "EXPENSIVE": "$$$$",
+    "MOST_EXPENSIVE": "$$$$$"
+}
+
+
+class MerchantRecord(NamedTuple):
+    """
+    Raw detail fields of one merchant, in OUTPUT_COLUMNS order
+
+    A plain tuple: no per-merchant key strings, and pickled across worker
+    processes at a fraction of a dict's size. Output formatting (price
+    range symbols, SIM/NAO flag) is applied in the parent by record_to_row.
+    """
+    nome: Any
+    rua: Any
+    numero: Any
+    bairro: Any
+    cidade: Any
+    cep: Any
+    latitude: Any
+    longitude: Any
+    cnpj: Any
+    price_range: Any  # priceRange code, e.g. 'CHEAP'
+    valor_minimo: Any
+    categoria: Any
+    avaliacao: Any
+    tempo_entrega: Any
+    valor_original: Any
+    super_restaurante: bool
+    extras: tuple = ()  # values of get_detail_fields(), in order
+
+
+def parse_merchant_record(data: dict) -> MerchantRecord:
+    """
+    Extract the raw fields of a merchant-info response
+
+    Args:
+        data: The 'data' field of the GraphQL response
+
+    Returns:
+        MerchantRecord (without extra fields)
+    """
+    # Nested objects may be explicit nulls (merchantExtra is optional), hence `or {}`
+    merchant = data.get('merchant') or {}
+    merchant_extra = data.get('merchantExtra') or {}
+    address = merchant_extra.get('address') or {}
+    cnpj = (merchant_extra.get('documents') or {}).get('CNPJ') or {}
+
+    return MerchantRecord(
+        merchant.get('name', ''),
+        address.get('streetName', ''),
+        address.get('streetNumber', ''),
+        address.get('district', ''),
+        address.get('city', ''),
+        address.get('zipCode', ''),
+        address.get('latitude', ''),
+        address.get('longitude', ''),
+        cnpj.get('value', ''),
+        merchant.get('priceRange', ''),
+        merchant_extra.get('minimumOrderValue', ''),
+        (merchant.get('mainCategory') or {}).get('name', ''),
+        merchant.get('userRating', ''),
+        merchant.get('deliveryTime', ''),
+        (merchant.get('deliveryFee') or {}).get('originalValue', ''),
+        "SUPER_RESTAURANT" in (merchant_extra.get('tags') or []),
+    )
+
+
+# Formatting from raw record fields to output values, by column; other columns pass through
+# as the API sent them (typed sinks convert them, see convert_value)
+VALUE_FORMATTERS = {
+    "PRECO MEDIO": lambda value: PRICE_RANGE_DISPLAY.get(value, value),
+    "SUPER RESTAURANTE": lambda value: "SIM" if value else "NAO",
+}
+
+
+def record_to_row(record: MerchantRecord, extra_fields: Optional[Iterable[str]] = None) -> Dict:
+    """
+    Format a MerchantRecord as an output row
+
+    Args:
+        record: Raw merchant fields
+        extra_fields: Names of the values in record.extras (default: get_detail_fields())
+
+    Returns:
+        Dictionary keyed by output column, extra fields last
+    """
+    row = {
+        name: VALUE_FORMATTERS[name](value) if name in VALUE_FORMATTERS else value
+        for name, value in zip(OUTPUT_COLUMNS, record)
+    }
+    row.update(zip(get_detail_fields() if extra_fields is None else extra_fields, record.extras))
+    return row
+
+
+def parse_merchant_details(data: dict) -> Dict:
+    """
+    Build an output row from the 'data' object of a merchant-info response
+
+    Args:
+        data: The 'data' field of the GraphQL response
+
+    Returns:
+        Dictionary with merchant details
+    """
+    return record_to_row(parse_merchant_record(data), ())
+
+
+def parse_details_response(body: dict) -> MerchantRecord:
+    """Extract a merchant's record from a merchant-info response, including any extra fields"""
+    data = body['data']
+    record = parse_merchant_record(data)
+    if _detail_fields:
+        record = record._replace(extras=tuple(extract_field(data, path) for path in _detail_fields))
+    return record
+
+
+def parse_batch_details_response(body: dict, size: int) -> List[Optional[MerchantRecord]]:
+    """
+    Split an aliased batch response back into one record per merchant
+
+    Args:
+        body: Decoded response of a build_batch_details_payload request
+        size: Number of merchants in the batch
+
+    Returns:
+        Records in request order; None for merchants the response has no data for
+    """
+    data = body['data']
+    if not isinstance(data, dict):
+        raise ValueError('batch response has no data')
+
+    records = []
+    for i in range(size):
+        merchant = data.get(f'm{i}')
+        if merchant is None:
+            records.append(None)
+            continue
+        records.append(parse_details_response({'data': {'merchant': merchant, 'merchantExtra': data.get(f'e{i}') or {}}}))
+    return records
+
+
+# Outcomes that signal congestion and trigger a multiplicative decrease
+CONGESTION_OUTCOMES = ('timeout', 'throttled', 'server_error')
+
+
+def request_outcome(errors: List[RequestError], failure: Optional[RequestError] = None) -> str:
+    """
+    Summarize a request's attempts as one outcome for the concurrency controller
+
+    Congestion seen on any attempt wins, even if a retry later succeeded.
+
+    Returns:
+        'ok' or a RequestError kind
+    """
+    for error in errors:
+        if error.kind in CONGESTION_OUTCOMES:
+            return error.kind
+    return failure.kind if failure is not None else 'ok'
+
+
+def fetch_merchant_details_with_outcome(
+    merchant_id: str,
+    latitude: str,
+    longitude: str,
+    headers: dict
+) -> Tuple[Optional[MerchantRecord], str, float]:
+    """
+    Fetch a single merchant and report how the request went
+
+    Args:
+        merchant_id: Merchant ID to fetch
+        latitude: Latitude for the request
+        longitude: Longitude for the request
+        headers: Request headers
+
+    Returns:
+        (record or None, outcome from request_outcome, latency in seconds)
+    """
+    url = build_details_url(latitude, longitude)
+    payload = build_details_payload(merchant_id)
+    trace = {}
+
+    try:
+        result = request_json(url, headers, payload, parse=parse_details_response, trace=trace)
+    except RequestError as e:
+        return None, request_outcome(trace.get('errors', []), e), trace.get('latency', 0.0)
+
+    return result, request_outcome(trace['errors']), trace['latency']
+
+
+def fetch_merchant_details(
+    merchant_id: str,
+    latitude: str,
+    longitude: str,
+    headers: dict
+) -> Optional[Dict]:
+    """
+    Fetch detailed information for a single merchant
+
+    Args:
+        merchant_id: Merchant ID to fetch
+        latitude: Latitude for the request
+        longitude: Longitude for the request
+        headers: Request headers
+
+    Returns:
+        Dictionary with merchant details or None if failed
+    """
+    record, _, _ = fetch_merchant_details_with_outcome(merchant_id, latitude, longitude, headers)
+    return record_to_row(record) if record else None
+
+
+# Per-merchant result of a batch: (merchant_id, record or None, outcome)
+MerchantResult = Tuple[str, Optional[MerchantRecord], str]
+
+
+def fetch_merchant_details_batch_with_outcome(
+    merchant_ids: List[str],
+    latitude: str,
+    longitude: str,
+    headers: dict
+) -> Tuple[List[MerchantResult], str, float]:
+    """
+    Fetch several merchants in one aliased GraphQL request
+
+    A batch that fails for good on an error of its own (BATCH_SPLIT_ERRORS)
+    is split in half and each half retried, down to single-merchant
+    requests; on congestion or auth errors its merchants fail with that
+    outcome instead of multiplying requests. Merchants missing from an
+    otherwise good response are fetched on their own.
+
+    Args:
+        merchant_ids: Merchant IDs to fetch
+        latitude: Latitude for the request
+        longitude: Longitude for the request
+        headers: Request headers
+
+    Returns:
+        (per-merchant results, outcome of the batch request, its latency in seconds)
+    """
+    if len(merchant_ids) == 1:
+        result, outcome, latency = fetch_merchant_details_with_outcome(merchant_ids[0], latitude, longitude, headers)
+        return [(merchant_ids[0], result, outcome)], outcome, latency
+
+    url = build_details_url(latitude, longitude)
+    payload = build_batch_details_payload(merchant_ids)
+    trace = {}
+
+    try:
+        records = request_json(
+            url, headers, payload, parse=lambda body: parse_batch_details_response(body, len(merchant_ids)),
+            max_attempts=BATCH_MAX_ATTEMPTS, trace=trace
+        )
+    except RequestError as e:
+        outcome = request_outcome(trace.get('errors', []), e)
+        if e.kind not in BATCH_SPLIT_ERRORS:
+            return [(merchant_id, None, e.kind) for merchant_id in merchant_ids], outcome, trace.get('latency', 0.0)
+        middle = len(merchant_ids) // 2
+        results = []
+        for half in (merchant_ids[:middle], merchant_ids[middle:]):
+            results.extend(fetch_merchant_details_batch_with_outcome(half, latitude, longitude, headers)[0])
+        return results, outcome, trace.get('latency', 0.0)
+
+    results = []
+    for merchant_id, record in zip(merchant_ids, records):
+        if record is None:
+            record, merchant_outcome, _ = fetch_merchant_details_with_outcome(merchant_id, latitude, longitude, headers)
+            results.append((merchant_id, record, merchant_outcome))
+        else:
+            results.append((merchant_id, record, 'ok'))
+    return results, request_outcome(trace['errors']), trace['latency']
+
+
+def print_progress(current: int, total: Optional[int]):
+    """Print an in-place progress bar (ASCII for Windows compatibility)"""
+    if total is None:
+        # Streaming input: the total is not known yet
+        print(f"\r   {current} merchants processed", end='', flush=True)
+        return
+
+    pct = (current / total) * 100 if total > 0 else 0
+    bar_length = 40
+    filled = int(bar_length * current / total) if total > 0 else 0
+    bar = '#' * filled + '-' * (bar_length - filled)
+    print(f"\r   [{bar}] {current}/{total} ({pct:.1f}%)", end='', flush=True)
+
+
+class ConcurrencyController:
+    """
+    AIMD (additive increase, multiplicative decrease) limit on requests in flight
+
+    The limit starts low and grows by one after every `window` completed
+    requests whose error rate and average latency stay healthy. Timeouts,
+    429s and 5xx responses cut it by `decrease_factor` straight away, at
+    most once per round of in-flight requests. Every change is printed with
+    its reason and kept in `history`.
+
+    The detail engines also use one (named 'batch size') to tune how many
+    merchants go into each batched request.
+    """
+
+    def __init__(
+        self,
+        initial: int = 4,
+        minimum: int = 1,
+        maximum: int = 64,
+        window: int = 20,
+        max_error_rate: float = 0.05,
+        latency_tolerance: float = 2.0,
+        decrease_factor: float = 0.5,
+        verbose: bool = True,
+        name: str = 'concurrency'
+    ):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self.window = window
+        self.max_error_rate = max_error_rate
+        self.latency_tolerance = latency_tolerance
+        self.decrease_factor = decrease_factor
+        self.verbose = verbose
+        self.history: List[Tuple[float, int, str]] = [(time.time(), self.limit, 'initial')]
+
+        self._latencies = []
+        self._errors = 0
+        self._since_change = 0
+        self._baseline_latency = None
+
+    def record(self, latency: float, outcome: str):
+        """Feed one completed request into the controller"""
+        self._since_change += 1
+
+        if outcome in CONGESTION_OUTCOMES:
+            # Requests already in flight at the old level may fail too; only react once per round
+            if self._since_change >= self.limit:
+                self._change(int(self.limit * self.decrease_factor), f"{outcome} response, backing off")
+            return
+
+        if outcome == 'ok':
+            self._latencies.append(latency)
+        else:
+            self._errors += 1
+
+        samples = len(self._latencies) + self._errors
+        if samples < self.window:
+            return
+
+        error_rate = self._errors / samples
+        avg_latency = sum(self._latencies) / len(self._latencies) if self._latencies else 0.0
+        self._latencies = []
+        self._errors = 0
+
+        if avg_latency and (self._baseline_latency is None or avg_latency < self._baseline_latency):
+            self._baseline_latency = avg_latency
+
+        if error_rate > self.max_error_rate:
+            self._change(int(self.limit * self.decrease_factor), f"error rate {error_rate:.0%}")
+        elif self._baseline_latency and avg_latency > self._baseline_latency * self.latency_tolerance:
+            self._change(int(self.limit * self.decrease_factor),
+                         f"latency {avg_latency:.2f}s over {self.latency_tolerance:g}x baseline {self._baseline_latency:.2f}s")
+        elif self.limit < self.maximum:
+            self._change(self.limit + 1, f"healthy (avg {avg_latency:.2f}s, {error_rate:.0%} errors)")
+
+    def _change(self, new_limit: int, reason: str):
+        new_limit = max(self.minimum, min(new_limit, self.maximum))
+        self._since_change = 0
+        if new_limit == self.limit:
+            return
+
+        old_limit, self.limit = self.limit, new_limit
+        self.history.append((time.time(), new_limit, reason))
+        if self.verbose:
+            print(f"\r   [{self.name}] {old_limit} -> {new_limit}: {reason}".ljust(80), flush=True)
+
+    def summary(self) -> str:
+        """One-line description of the final level"""
+        return f"final {self.name} {self.limit} (range {self.minimum}-{self.maximum}, {len(self.history) - 1} changes)"
+
+
+def batch_rows(merchant_results: List[MerchantResult], failures: Dict[str, int]) -> List[Tuple[str, Dict]]:
+    """
+    Turn a completed batch into output rows, counting the merchants that failed
+
+    Args:
+        merchant_results: (merchant_id, record or None, outcome) per merchant
+        failures: Failed merchant counts by outcome, updated in place
+
+    Returns:
+        (merchant_id, row) for every merchant that was fetched
+    """
+    extra_fields = get_detail_fields()
+    rows = []
+    for merchant_id, record, outcome in merchant_results:
+        if record:
+            rows.append((merchant_id, record_to_row(record, extra_fields)))
+        else:
+            failures[outcome] = failures.get(outcome, 0) + 1
+    return rows
+
+
+def print_failures(failures: Dict[str, int]):
+    """Print failed merchant counts by error kind, so lost rows are never silent"""
+    if failures:
+        detail = ', '.join(f"{kind}: {count}" for kind, count in sorted(failures.items()))
+        print(f"   Failed: {sum(failures.values())} merchants ({detail})")
+
+
+# Per-process worker state, set once by init_detail_worker
+_worker_headers: Optional[dict] = None
+_worker_coordinates: Optional[Tuple[str, str]] = None
+
+
+def init_detail_worker(
+    headers: dict,
+    coordinates: Tuple[str, str],
+    pool_size: int = DEFAULT_POOL_SIZE,
+    http_retries: int = DEFAULT_HTTP_RETRIES,
+    rate_limiter: Optional[RateLimiter] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    detail_fields: Tuple[str, ...] = (),
+    header_pool: Optional[HeaderPool] = None
+):
+    """Pool initializer: ship headers, coordinates, the shared limiter/breaker/sessions and the query fields to the worker once"""
+    global _worker_headers, _worker_coordinates
+    _worker_headers = headers
+    _worker_coordinates = coordinates
+    init_session(pool_size, http_retries)
+    set_rate_limiter(rate_limiter)
+    set_circuit_breaker(circuit_breaker)
+    set_detail_fields(detail_fields)
+    set_header_pool(header_pool)
+
+
+def worker_fetch_details_batch(merchant_ids: List[str]) -> Tuple[List[MerchantResult], str, float]:
+    """Worker function for multiprocessing pool (batched requests)"""
+    return fetch_merchant_details_batch_with_outcome(
+        merchant_ids, _worker_coordinates[0], _worker_coordinates[1], _worker_headers
+    )
+
+
+def make_batch_controller(batch_size: int) -> ConcurrencyController:
+    """AIMD controller for the number of merchants per detail request, up to batch_size"""
+    return ConcurrencyController(
+        initial=min(5, batch_size), maximum=batch_size, window=10, latency_tolerance=3.0, name='batch size'
+    )
+
+
+def fetch_all_merchant_details(
+    merchant_ids: Iterable[str],
+    default_coordinates: Tuple[str, str],
+    headers: dict,
+    num_workers: int = 8,
+    pool_size: int = DEFAULT_POOL_SIZE,
+    http_retries: int = DEFAULT_HTTP_RETRIES,
+    total: Optional[int] = None,
+    controller: Optional[ConcurrencyController] = None,
+    on_result: Optional[Callable[[str, Dict], None]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_controller: Optional[ConcurrencyController] = None,
+    collect: bool = True
+) -> List[Dict]:
+    """
+    Fetch details for all merchants using parallel processing
+
+    The pool holds `num_workers` processes, but only as many tasks as the
+    concurrency controller allows are in flight at any time. Each task is
+    one request for up to `batch_size` merchants (see
+    fetch_merchant_details_batch_with_outcome).
+
+    Args:
+        merchant_ids: Merchant IDs to fetch
+        default_coordinates: (lat, lon) tuple for detail requests
+        headers: Request headers
+        num_workers: Number of worker processes (upper bound for the controller)
+        pool_size: Connections pooled by each worker's session
+        http_retries: Transport-level retries per request
+        total: Number of IDs for progress display (default: len(merchant_ids)
+               when it has one, otherwise unknown)
+        controller: Concurrency controller (default: AIMD starting at 2)
+        on_result: Optional callback receiving (merchant_id, row) for every
+                   successful fetch, e.g. ScrapeJournal.save_detail
+        batch_size: Maximum merchants per request (1 disables batching)
+        batch_controller: Batch size controller (default: AIMD starting at 5)
+        collect: Keep rows in the returned list (False when on_result already
+                 stores them, so memory stays flat)
+
+    Returns:
+        List of merchant detail dictionaries (empty when collect is False)
+    """
+    if total is None and isinstance(merchant_ids, Sized):
+        total = len(merchant_ids)
+    if controller is None:
+        controller = ConcurrencyController(initial=min(2, num_workers), maximum=num_workers)
+    if batch_controller is None:
+        batch_controller = make_batch_controller(batch_size)
+
+    results = []
+    failures = {}
+    done = 0
+
+    print(f"   Processing {total if total is not None else 'streamed'} merchants with up to {num_workers} workers (adaptive)...")
+
+    completed = queue.Queue()
+    initargs = (headers, default_coordinates, pool_size, http_retries, get_rate_limiter(), get_circuit_breaker(),
+                get_detail_fields(), get_header_pool())
+    with Pool(processes=num_workers, initializer=init_detail_worker, initargs=initargs) as pool:
+        id_iter = iter(merchant_ids)
+        in_flight = 0
+        exhausted = False
+
+        while True:
+            # Top up to the controller's current limit
+            while not exhausted and in_flight < controller.limit:
+                batch = list(islice(id_iter, batch_controller.limit))
+                if len(batch) < batch_controller.limit:
+                    exhausted = True
+                if not batch:
+                    break
+                pool.apply_async(
+                    worker_fetch_details_batch, (batch,),
+                    callback=completed.put,
+                    error_callback=lambda e, ids=batch: completed.put(([(mid, None, 'error') for mid in ids], 'error', 0.0))
+                )
+                in_flight += 1
+
+            if in_flight == 0:
+                break
+
+            # Results come back to the parent, which is also the only progress counter
+            merchant_results, outcome, latency = completed.get()
+            in_flight -= 1
+            controller.record(latency, outcome)
+            batch_controller.record(latency, outcome)
+            for merchant_id, row in batch_rows(merchant_results, failures):
+                if collect:
+                    results.append(row)
+                if on_result:
+                    on_result(merchant_id, row)
+            done += len(merchant_results)
+            print_progress(done, total)
+
+    print()  # New line after progress
+    print(f"   {controller.summary()}")
+    if batch_size > 1:
+        print(f"   {batch_controller.summary()}")
+    print_failures(failures)
+    return results
+
+
+async def request_json_async(
+    session,
+    url: str,
+    headers: dict,
+    payload: dict,
+    parse: Optional[Callable[[Any], Any]] = None,
+    max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+    trace: Optional[dict] = None
+) -> Any:
+    """
+    Event-loop version of request_json on an aiohttp session
+
+    Same classification, backoff, Retry-After, circuit breaker and session
+    pool handling.
+
+    Raises:
+        RequestError: When the request fails for good
+    """
+    breaker = get_circuit_breaker()
+    header_pool = get_header_pool()
+    errors = []
+    if trace is not None:
+        trace['errors'] = errors
+
+    attempt = 0
+    while True:
+        await breaker.wait_async()
+        request_headers = headers
+        if header_pool is not None:
+            session_index, session_headers = await header_pool.checkout_async()
+            request_headers = {**headers, **session_headers}
+        await get_rate_limiter().acquire_async(url)
+        start = time.monotonic()
+        try:
+            async with session.post(url, headers=request_headers, json=payload) as response:
+                body = await response.read() if response.status == 403 else b''
+                error = classify_status(response.status, response.headers.get('Retry-After'), body)
+                if error is None:
+                    result = decode_json(await response.read())
+            if error is None:
+                if parse is not None:
+                    result = parse_body(parse, result)
+                breaker.record_success()
+                if header_pool is not None:
+                    header_pool.release(session_index)
+                if trace is not None:
+                    trace['latency'] = time.monotonic() - start
+                return result
+        except Exception as e:
+            error = classify_exception(e)
+
+        if trace is not None:
+            trace['latency'] = time.monotonic() - start
+        errors.append(error)
+        breaker.record_failure(error)
+        if header_pool is not None:
+            header_pool.release(session_index, error)
+            if error.kind == 'auth' and header_pool.recoverable():
+                continue  # that session expired: replay on another (or a refreshed) one, not counted as an attempt
+
+        if not error.retryable or attempt == max_attempts - 1:
+            raise error
+        await asyncio.sleep(error.retry_after if error.retry_after is not None else backoff_delay(attempt))
+        attempt += 1
+
+
+async def _fetch_merchant_details_async(session, merchant_id: str, coordinates: Tuple[str, str], headers: dict) -> Tuple[Optional[MerchantRecord], str, float]:
+    """Fetch a single merchant on the event loop (see fetch_merchant_details_with_outcome)"""
+    if session is None or isinstance(session, requests.Session):
+        # No async client installed: run the blocking call in a thread, on the given requests session
+        return await asyncio.to_thread(
+            call_with_session, session, fetch_merchant_details_with_outcome, merchant_id, coordinates[0], coordinates[1],
+            headers
+        )
+
+    url = build_details_url(*coordinates)
+    trace = {}
+
+    try:
+        result = await request_json_async(
+            session, url, headers, build_details_payload(merchant_id),
+            parse=parse_details_response, trace=trace
+        )
+    except RequestError as e:
+        return None, request_outcome(trace.get('errors', []), e), trace.get('latency', 0.0)
+
+    return result, request_outcome(trace['errors']), trace['latency']
+
+
+async def _fetch_merchant_details_batch_async(
+    session, merchant_ids: List[str], coordinates: Tuple[str, str], headers: dict
+) -> Tuple[List[MerchantResult], str, float]:
+    """Fetch several merchants on the event loop (see fetch_merchant_details_batch_with_outcome)"""
+    if session is None or isinstance(session, requests.Session):
+        return await asyncio.to_thread(
+            call_with_session, session, fetch_merchant_details_batch_with_outcome, merchant_ids, coordinates[0],
+            coordinates[1], headers
+        )
+
+    if len(merchant_ids) == 1:
+        result, outcome, latency = await _fetch_merchant_details_async(session, merchant_ids[0], coordinates, headers)
+        return [(merchant_ids[0], result, outcome)], outcome, latency
+
+    url = build_details_url(*coordinates)
+    trace = {}
+
+    try:
+        records = await request_json_async(
+            session, url, headers, build_batch_details_payload(merchant_ids),
+            parse=lambda body: parse_batch_details_response(body, len(merchant_ids)),
+            max_attempts=BATCH_MAX_ATTEMPTS, trace=trace
+        )
+    except RequestError as e:
+        outcome = request_outcome(trace.get('errors', []), e)
+        if e.kind not in BATCH_SPLIT_ERRORS:
+            return [(merchant_id, None, e.kind) for merchant_id in merchant_ids], outcome, trace.get('latency', 0.0)
+        middle = len(merchant_ids) // 2
+        halves = await asyncio.gather(*(
+            _fetch_merchant_details_batch_async(session, half, coordinates, headers)
+            for half in (merchant_ids[:middle], merchant_ids[middle:])
+        ))
+        return [result for half_results, _, _ in halves for result in half_results], outcome, trace.get('latency', 0.0)
+
+    async def complete(merchant_id, record):
+        if record is not None:
+            return merchant_id, record, 'ok'
+        record, outcome, _ = await _fetch_merchant_details_async(session, merchant_id, coordinates, headers)
+        return merchant_id, record, outcome
+
+    results = await asyncio.gather(*(complete(merchant_id, record) for merchant_id, record in zip(merchant_ids, records)))
+    return list(results), request_outcome(trace['errors']), trace['latency']
+
+
+async def fetch_all_merchant_details_async(
+    merchant_ids: Iterable[str],
+    default_coordinates: Tuple[str, str],
+    headers: dict,
+    concurrency: int = 100,
+    total: Optional[int] = None,
+    controller: Optional[ConcurrencyController] = None,
+    on_result: Optional[Callable[[str, Dict], None]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    batch_controller: Optional[ConcurrencyController] = None,
+    collect: bool = True
+) -> List[Dict]:
+    """
+    Fetch details for all merchants with asyncio
+
+    Requests are pure I/O, so a single event loop keeps many GraphQL calls
+    in flight instead of one per worker process. How many is decided by the
+    concurrency controller, up to `concurrency`. Uses aiohttp when installed
+    and falls back to running requests in threads otherwise. IDs without a
+    length (e.g. stream_merchant_ids_from_locations) are read from a thread
+    so a slow producer never blocks the event loop. Each request carries up
+    to `batch_size` merchants (see fetch_merchant_details_batch_with_outcome).
+
+    Args:
+        merchant_ids: Merchant IDs to fetch
+        default_coordinates: (lat, lon) tuple for detail requests
+        headers: Request headers
+        concurrency: Maximum number of requests in flight
+        total: Number of IDs for progress display (default: len(merchant_ids)
+               when it has one, otherwise unknown)
+        controller: Concurrency controller (default: AIMD starting at 8)
+        on_result: Optional callback receiving (merchant_id, row) for every
+                   successful fetch (called on the event loop)
+        batch_size: Maximum merchants per request (1 disables batching)
+        batch_controller: Batch size controller (default: AIMD starting at 5)
+        collect: Keep rows in the returned list (False when on_result already
+                 stores them, so memory stays flat)
+
+    Returns:
+        List of merchant detail dictionaries (empty when collect is False)
+    """
+    if total is None and isinstance(merchant_ids, Sized):
+        total = len(merchant_ids)
+    if controller is None:
+        controller = ConcurrencyController(initial=min(8, concurrency), maximum=concurrency)
+    if batch_controller is None:
+        batch_controller = make_batch_controller(batch_size)
+
+    results = []
+    failures = {}
+    done = 0
+    in_flight = 0
+    slots = asyncio.Condition()
+
+    # aiohttp only decodes gzip/deflate out of the box
+    request_headers = {k: v for k, v in headers.items() if k != 'Host'}
+    request_headers['Accept-Encoding'] = 'gzip, deflate'
+
+    id_iter = iter(merchant_ids)
+    id_lock = asyncio.Lock()
+    streamed = not isinstance(merchant_ids, Sized)
+
+    def take(size):
+        return list(islice(id_iter, size))
+
+    async def next_batch():
+        if not streamed:
+            return take(batch_controller.limit)
+        # A streamed iterable may block waiting for discovery: read it off the loop
+        async with id_lock:
+            return await asyncio.to_thread(take, batch_controller.limit)
+
+    async def worker(session):
+        nonlocal done, in_flight
+        while True:
+            batch = await next_batch()
+            if not batch:
+                return
+
+            async with slots:
+                await slots.wait_for(lambda: in_flight < controller.limit)
+                in_flight += 1
+
+            merchant_results, outcome, latency = await _fetch_merchant_details_batch_async(
+                session, batch, default_coordinates, request_headers
+            )
+
+            async with slots:
+                in_flight -= 1
+                controller.record(latency, outcome)
+                batch_controller.record(latency, outcome)
+                slots.notify_all()
+
+            for merchant_id, row in batch_rows(merchant_results, failures):
+                if collect:
+                    results.append(row)
+                if on_result:
+                    on_result(merchant_id, row)
+            done += len(merchant_results)
+            print_progress(done, total)
+
+    if HAS_AIOHTTP:
+        # The connector keeps up to `concurrency` keep-alive connections
+        connector = aiohttp.TCPConnector(limit=concurrency, ssl=False)
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    else:
+        # The worker threads get their own session sized to match, with the configured transport retries;
+        # the shared one stays with discovery
+        session = create_session(max(concurrency, DEFAULT_POOL_SIZE), _session_retries)
+        try:
+            await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+        finally:
+            session.close()
+
+    print()  # New line after progress
+    print(f"   {controller.summary()}")
+    if batch_size > 1:
+        print(f"   {batch_controller.summary()}")
+    print_failures(failures)
+    return results
+
+
+def fetch_all_merchant_details_concurrent(
+    merchant_ids: Iterable[str],
+    default_coordinates: Tuple[str, str],
+    headers: dict,
+    concurrency: int = 100,
+    total: Optional[int] = None,
+    on_result: Optional[Callable[[str, Dict], None]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    collect: bool = True
+) -> List[Dict]:
+    """
+    Synchronous entry point for fetch_all_merchant_details_async
+
+    Args:
+        merchant_ids: Merchant IDs to fetch (a list or a streamed iterable)
+        default_coordinates: (lat, lon) tuple for detail requests
+        headers: Request headers
+        concurrency: Maximum number of requests in flight
+        total: Number of IDs for progress display (default: len(merchant_ids) if known)
+        on_result: Optional callback receiving (merchant_id, row) for every successful fetch
+        batch_size: Maximum merchants per request (1 disables batching)
+        collect: Keep rows in the returned list (False when on_result already stores them)
+
+    Returns:
+        List of merchant detail dictionaries
+    """
+    if total is None and isinstance(merchant_ids, Sized):
+        total = len(merchant_ids)
+
+    backend = 'aiohttp' if HAS_AIOHTTP else 'threads'
+    count = total if total is not None else 'streamed'
+    print(f"   Processing {count} merchants with up to {concurrency} concurrent requests ({backend}, adaptive)...")
+    return asyncio.run(fetch_all_merchant_details_async(
+        merchant_ids, default_coordinates, headers, concurrency, total, on_result=on_result, batch_size=batch_size,
+        collect=collect
+    ))
+
+
+class ScrapeJournal:
+    """
+    Crash-safe checkpoint of a scrape, stored in SQLite
+
+    Records which locations finished discovery, the pagination cursor of
+    the ones still in progress, every discovered merchant ID and every
+    fetched detail row, so an interrupted run can resume instead of starting
+    over. The database runs in WAL mode: each write is a small append that
+    survives a crash without blocking concurrent readers.
+
+    Writes come from discovery threads and the detail loop, so one
+    connection is shared behind a lock.
+    """
+
+    def __init__(self, path='scrape_journal.db', category='HOME_FOOD_DELIVERY'):
+        """
+        Args:
+            path: SQLite database file
+            category: Category alias this journal's rows belong to
+        """
+        self.path = str(path)
+        self.category = category
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS locations (
+                category TEXT, latitude TEXT, longitude TEXT,
+                done INTEGER DEFAULT 0, cursor TEXT, section_id TEXT,
+                PRIMARY KEY (category, latitude, longitude));
+            CREATE TABLE IF NOT EXISTS merchant_ids (
+                category TEXT, merchant_id TEXT,
+                PRIMARY KEY (category, merchant_id));
+            CREATE TABLE IF NOT EXISTS details (
+                category TEXT, merchant_id TEXT, row TEXT,
+                PRIMARY KEY (category, merchant_id));
+        """)
+
+    def _write(self, statements: List[Tuple[str, Any]]):
+        """Run statements in a single transaction"""
+        with self._lock:
+            self._db.execute('BEGIN')
+            try:
+                for sql, params in statements:
+                    if isinstance(params, list):
+                        self._db.executemany(sql, params)
+                    else:
+                        self._db.execute(sql, params)
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _read(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._db.execute(sql, (self.category,) + params).fetchall()
+
+    def reset(self):
+        """Forget everything recorded for this category (start a fresh run)"""
+        self._write([
+            (f'DELETE FROM {table} WHERE category = ?', (self.category,))
+            for table in ('locations', 'merchant_ids', 'details')
+        ])
+
+    def record_page(self, latitude: str, longitude: str, page: HomePage):
+        """Store one discovery page: its IDs and the cursor to continue from"""
+        self._write([
+            ('INSERT OR IGNORE INTO merchant_ids VALUES (?, ?)',
+             [(self.category, mid) for mid in page.merchant_ids]),
+            ('INSERT OR REPLACE INTO locations VALUES (?, ?, ?, 0, ?, ?)',
+             (self.category, latitude, longitude, page.cursor, page.section_id)),
+        ])
+
+    def complete_location(self, latitude: str, longitude: str):
+        """Mark a location as fully paginated"""
+        self._write([
+            ('INSERT OR REPLACE INTO locations VALUES (?, ?, ?, 1, NULL, NULL)',
+             (self.category, latitude, longitude)),
+        ])
+
+    def completed_locations(self) -> set:
+        """(latitude, longitude) pairs whose discovery finished"""
+        rows = self._read('SELECT latitude, longitude FROM locations WHERE category = ? AND done = 1')
+        return {(lat, lon) for lat, lon in rows}
+
+    def location_cursor(self, latitude: str, longitude: str) -> Optional[HomePage]:
+        """Page to resume an interrupted location from, or None to start at the top"""
+        rows = self._read(
+            'SELECT cursor, section_id FROM locations WHERE category = ? AND latitude = ? AND longitude = ?'
+            ' AND done = 0 AND cursor IS NOT NULL',
+            (latitude, longitude)
+        )
+        if not rows:
+            return None
+        cursor, section_id = rows[0]
+        return HomePage([], cursor, section_id)
+
+    def merchant_ids(self) -> List[str]:
+        """Every merchant ID discovered so far"""
+        return [mid for (mid,) in self._read('SELECT merchant_id FROM merchant_ids WHERE category = ? ORDER BY rowid')]
+
+    def pending_merchant_ids(self) -> List[str]:
+        """Discovered merchant IDs that have no detail row yet"""
+        rows = self._read(
+            'SELECT merchant_id FROM merchant_ids WHERE category = ? AND merchant_id NOT IN'
+            ' (SELECT merchant_id FROM details WHERE category = merchant_ids.category) ORDER BY rowid'
+        )
+        return [mid for (mid,) in rows]
+
+    def save_detail(self, merchant_id: str, row: Dict):
+        """Store a fetched detail row"""
+        self._write([
+            ('INSERT OR REPLACE INTO details VALUES (?, ?, ?)',
+             (self.category, merchant_id, json.dumps(row, ensure_ascii=False))),
+        ])
+
+    def details(self) -> List[Dict]:
+        """Every detail row fetched so far, in fetch order"""
+        return [row for _, row in self.detail_items()]
+
+    def detail_items(self) -> Iterable[Tuple[str, Dict]]:
+        """
+        (merchant_id, row) for every detail row fetched so far, in fetch order
+
+        Rows are read lazily from the database; don't write to the journal
+        while iterating.
+        """
+        cursor = self._db.execute(
+            'SELECT merchant_id, row FROM details WHERE category = ? ORDER BY rowid', (self.category,)
+        )
+        for merchant_id, row in cursor:
+            yield merchant_id, json.loads(row)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(latitude: float, longitude: float, precision: int = DEFAULT_GEOHASH_PRECISION) -> str:
+    """
+    Encode a coordinate as a geohash cell
+
+    Args:
+        latitude: Latitude in degrees
+        longitude: Longitude in degrees
+        precision: Number of characters (7 gives cells of about 150 m)
+
+    Returns:
+        Geohash string
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    cell = []
+    bits = 0
+    value = 0
+    even = True  # bits alternate between longitude and latitude, longitude first
+
+    while len(cell) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        if coordinate >= middle:
+            value = (value << 1) | 1
+            interval[0] = middle
+        else:
+            value <<= 1
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            cell.append(GEOHASH_ALPHABET[value])
+            bits = 0
+            value = 0
+
+    return ''.join(cell)
+
+
+class CachedDiscovery(NamedTuple):
+    """Cached discovery result of one (category, geohash cell)"""
+    merchant_ids: List[str]
+    first_page: List[str]  # IDs of the first page, used for revalidation
+    fresh: bool
+
+
+class DiscoveryCache:
+    """
+    On-disk cache of discovery results keyed by category and geohash cell
+
+    Walking a location's paginated home feed costs one request per page;
+    re-running the same grid within `ttl` seconds answers each location from
+    the cache instead. Expired entries are kept so they can be revalidated
+    cheaply against the first page (see fetch_merchant_ids_from_locations).
+    """
+
+    def __init__(self, path='discovery_cache.db', ttl: float = DEFAULT_DISCOVERY_CACHE_TTL,
+                 precision: int = DEFAULT_GEOHASH_PRECISION):
+        """
+        Args:
+            path: SQLite database file
+            ttl: Seconds a cached location stays fresh
+            precision: Geohash length used to quantize coordinates
+        """
+        self.path = str(path)
+        self.ttl = ttl
+        self.precision = precision
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS locations (category TEXT, cell TEXT, fetched_at REAL,'
+            ' first_page TEXT, merchant_ids TEXT, PRIMARY KEY (category, cell))'
+        )
+
+    def cell(self, latitude: str, longitude: str) -> str:
+        """Geohash cell a coordinate falls in"""
+        return geohash_encode(float(latitude), float(longitude), self.precision)
+
+    def get(self, category: str, latitude: str, longitude: str, allow_stale: bool = False) -> Optional[CachedDiscovery]:
+        """
+        Look up a location
+
+        Args:
+            category: Category alias
+            latitude: Latitude coordinate
+            longitude: Longitude coordinate
+            allow_stale: Also return expired entries (with fresh=False)
+
+        Returns:
+            CachedDiscovery, or None on a miss
+        """
+        with self._lock:
+            found = self._db.execute(
+                'SELECT fetched_at, first_page, merchant_ids FROM locations WHERE category = ? AND cell = ?',
+                (category, self.cell(latitude, longitude))
+            ).fetchone()
+            fresh = found is not None and time.time() - found[0] <= self.ttl
+            if fresh:
+                self.hits += 1
+            elif found is not None and allow_stale:
+                self.stale += 1
+            else:
+                self.misses += 1
+                return None
+        return CachedDiscovery(json.loads(found[2]), json.loads(found[1]), fresh)
+
+    def put(self, category: str, latitude: str, longitude: str, first_page: List[str], merchant_ids: List[str]):
+        """Store (or refresh) the result of a complete walk of a location's feed"""
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO locations VALUES (?, ?, ?, ?, ?)',
+                (category, self.cell(latitude, longitude), time.time(),
+                 json.dumps(first_page), json.dumps(merchant_ids))
+            )
+
+    def summary(self) -> str:
+        """One-line hit/miss statistics"""
+        return f"discovery cache: {self.hits} hits, {self.stale} expired (revalidated), {self.misses} misses"
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class DetailCache:
+    """
+    On-disk cache of merchant detail rows, shared across runs and categories
+
+    Address, CNPJ and category rarely change and many merchants appear under
+    several category aliases, so a row fetched recently is reused instead of
+    calling the merchant-info endpoint again. Entries older than `ttl`
+    seconds are treated as misses; once the cache holds more than
+    `max_entries` rows the oldest are evicted.
+    """
+
+    def __init__(self, path='merchant_cache.db', ttl: float = DEFAULT_CACHE_TTL,
+                 max_entries: int = DEFAULT_CACHE_MAX_ENTRIES):
+        """
+        Args:
+            path: SQLite database file
+            ttl: Seconds a cached row stays fresh
+            max_entries: Rows kept before the oldest are evicted
+        """
+        self.path = str(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS details (merchant_id TEXT PRIMARY KEY, fetched_at REAL, row TEXT)'
+        )
+        self._db.execute('CREATE INDEX IF NOT EXISTS details_fetched_at ON details (fetched_at)')
+
+        # Expired rows will never be served again
+        self._db.execute('DELETE FROM details WHERE fetched_at < ?', (time.time() - ttl,))
+        self._size = self._db.execute('SELECT COUNT(*) FROM details').fetchone()[0]
+
+    def get(self, merchant_id: str, required_columns: Iterable[str] = ()) -> Optional[Dict]:
+        """Return the cached row if it is still fresh and has every required column, otherwise None"""
+        with self._lock:
+            found = self._db.execute(
+                'SELECT fetched_at, row FROM details WHERE merchant_id = ?', (merchant_id,)
+            ).fetchone()
+            if found is None:
+                self.misses += 1
+                return None
+            fetched_at, row = found
+            if time.time() - fetched_at > self.ttl:
+                self.misses += 1
+                self.expired += 1
+                return None
+            row = json.loads(row)
+            if any(column not in row for column in required_columns):
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row
+
+    def put(self, merchant_id: str, row: Dict):
+        """Store a freshly fetched row, evicting the oldest ones when full"""
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO details VALUES (?, ?, ?)',
+                (merchant_id, time.time(), json.dumps(row, ensure_ascii=False))
+            )
+            # Upper bound (replacements don't grow the table); recount only when it may be full
+            self._size += 1
+            if self._size <= self.max_entries:
+                return
+            self._size = self._db.execute('SELECT COUNT(*) FROM details').fetchone()[0]
+            if self._size > self.max_entries:
+                # Evict in batches so a full cache does not pay a DELETE per insert
+                excess = self._size - self.max_entries + max(1, self.max_entries // 100)
+                self.evicted += self._db.execute(
+                    'DELETE FROM details WHERE merchant_id IN'
+                    ' (SELECT merchant_id FROM details ORDER BY fetched_at LIMIT ?)',
+                    (excess,)
+                ).rowcount
+                self._size -= excess
+
+    def skip_cached(self, merchant_ids: Iterable[str], on_hit: Callable[[str, Dict], None],
+                    required_columns: Iterable[str] = ()) -> Iterable[str]:
+        """
+        Yield only the merchant IDs that need a network fetch
+
+        Args:
+            merchant_ids: Merchant IDs (a list or a streamed iterable)
+            on_hit: Callback receiving (merchant_id, row) for every fresh cached row
+            required_columns: Columns a cached row must have to be reused (e.g. extra fields)
+
+        Yields:
+            Merchant IDs missing from the cache, expired, or cached without a required column
+        """
+        required_columns = list(required_columns)
+        for merchant_id in merchant_ids:
+            row = self.get(merchant_id, required_columns)
+            if row is None:
+                yield merchant_id
+            else:
+                on_hit(merchant_id, row)
+
+    def summary(self) -> str:
+        """One-line hit/miss statistics"""
+        lookups = self.hits + self.misses
+        rate = self.hits / lookups if lookups else 0.0
+        return (f"detail cache: {self.hits} hits, {self.misses} misses ({rate:.0%} hit rate), "
+                f"{self.expired} expired, {self.evicted} evicted")
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class ResultSink:
+    """
+    Destination that output rows are streamed to as they complete
+
+    Rows are buffered and handed to the file every `flush_rows` rows or
+    `flush_interval` seconds, whichever comes first, so memory stays flat
+    however many merchants there are and an interrupted run leaves a valid
+    file with everything flushed so far. Safe to call from several threads.
+
+    Subclasses implement _write_rows and _close.
+    """
+
+    def __init__(self, path, columns: List[str], flush_rows: int = 500, flush_interval: float = 5.0):
+        """
+        Args:
+            path: Output file
+            columns: Output columns, in order
+            flush_rows: Rows buffered before they are written
+            flush_interval: Seconds after which buffered rows are written anyway
+        """
+        self.path = str(path)
+        self.columns = columns
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.rows_written = 0
+        self.closed = False
+        self._pending = []
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def write(self, row: Dict):
+        """Queue a row for output"""
+        with self._lock:
+            self._pending.append(row)
+            if len(self._pending) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        """Write every buffered row now"""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._write_rows(self._pending)
+            self.rows_written += len(self._pending)
+            self._pending = []
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        """Flush and finish the file (a second call does nothing)"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._flush()
+            self._close()
+
+    def _write_rows(self, rows: List[Dict]):
+        raise NotImplementedError
+
+    def _close(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def csv_value(value: Any) -> Any:
+    """List and object values (extra fields crossing lists) as JSON, like the typed sinks; others unchanged"""
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else value
+
+
+class CsvSink(ResultSink):
+    """CSV output (UTF-8 with BOM so Excel detects the encoding), appended one flush at a time"""
+
+    def __init__(self, path, columns: List[str], flush_rows: int = 500, flush_interval: float = 5.0):
+        super().__init__(path, columns, flush_rows, flush_interval)
+        self._file = open(self.path, 'w', newline='', encoding='utf-8-sig')
+        csv.writer(self._file).writerow(columns)
+        self._file.flush()
+
+    def _write_rows(self, rows: List[Dict]):
+        # Each flush is a single write of whole lines, so the file never ends mid-row
+        buffer = io.StringIO()
+        csv.DictWriter(buffer, self.columns, extrasaction='ignore').writerows(
+            {key: csv_value(value) for key, value in row.items()} for row in rows
+        )
+        self._file.write(buffer.getvalue())
+        self._file.flush()
+
+    def _close(self):
+        self._file.close()
+
+
+# Column types for columnar output; columns not listed (extra fields) are strings
+COLUMN_TYPES = {
+    "LATITUDE": 'float64',
+    "LONGITUDE": 'float64',
+    "VALOR MINIMO": 'float64',
+    "AVALIACAO": 'float64',
+    "TEMPO ENTREGA": 'int32',
+    "VALOR ORIGINAL": 'float64',
+    "PRECO MEDIO": 'category',
+    "SUPER RESTAURANTE": 'bool',
+}
+
+
+def convert_value(value: Any, column_type: str) -> Any:
+    """
+    Convert a row value to a column type; missing or unparsable values become None
+
+    Args:
+        value: Value from a detail row
+        column_type: 'float64', 'int32', 'bool', 'category' or 'string'
+
+    Returns:
+        Converted value
+    """
+    if value is None or value == '':
+        return None
+    try:
+        if column_type == 'float64':
+            return float(value)
+        if column_type == 'int32':
+            return int(float(value))
+    except (TypeError, ValueError):
+        return None
+    if column_type == 'bool':
+        return value == "SIM" if isinstance(value, str) else bool(value)
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (list, dict)) else str(value)
+
+
+class ArrowSink(ResultSink):
+    """
+    Typed columnar output: Parquet or Arrow IPC (Feather v2)
+
+    Every flush becomes one row group (Parquet) or record batch (Arrow),
+    typed by COLUMN_TYPES: float64 coordinates, prices and ratings, int32
+    delivery time, dictionary-encoded price range and a boolean
+    super-restaurant flag. Both formats write their footer on close, so the
+    file is only readable once the sink is closed.
+
+    Dictionary columns keep one growing dictionary for the whole file, so
+    every batch's dictionary extends the previous one (Arrow IPC files
+    accept deltas but not replacements).
+    """
+
+    ARROW_TYPES = {
+        'float64': lambda: pa.float64(),
+        'int32': lambda: pa.int32(),
+        'bool': lambda: pa.bool_(),
+        'category': lambda: pa.dictionary(pa.int8(), pa.string()),
+        'string': lambda: pa.string(),
+    }
+
+    def __init__(self, path, columns: List[str], fmt: str = 'parquet',
+                 flush_rows: int = 10000, flush_interval: float = 30.0):
+        """
+        Args:
+            path: Output file
+            columns: Output columns, in order
+            fmt: 'parquet' or 'feather'
+            flush_rows: Rows per row group / record batch
+            flush_interval: Seconds after which a smaller row group is written anyway
+        """
+        if not HAS_PYARROW:
+            raise ImportError("pyarrow is required for Parquet/Feather output (pip install pyarrow)")
+        super().__init__(path, columns, flush_rows, flush_interval)
+        self.fmt = fmt
+        self.types = [COLUMN_TYPES.get(column, 'string') for column in columns]
+        self.schema = pa.schema([
+            pa.field(column, self.ARROW_TYPES[column_type]()) for column, column_type in zip(columns, self.types)
+        ])
+        self._categories = {column: {} for column, column_type in zip(columns, self.types) if column_type == 'category'}
+        if fmt == 'parquet':
+            self._writer = pq.ParquetWriter(self.path, self.schema, compression='zstd')
+        else:
+            options = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+            self._writer = pa.ipc.new_file(self.path, self.schema, options=options)
+
+    def _array(self, column: str, column_type: str, values: List[Any]):
+        if column_type != 'category':
+            return pa.array(values, type=self.ARROW_TYPES[column_type]())
+        categories = self._categories[column]
+        indices = [None if value is None else categories.setdefault(value, len(categories)) for value in values]
+        return pa.DictionaryArray.from_arrays(
+            pa.array(indices, type=pa.int8()), pa.array(list(categories), type=pa.string())
+        )
+
+    def _write_rows(self, rows: List[Dict]):
+        arrays = [
+            self._array(column, column_type, [convert_value(row.get(column), column_type) for row in rows])
+            for column, column_type in zip(self.columns, self.types)
+        ]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.fmt == 'parquet':
+            self._writer.write_table(pa.Table.from_batches([batch]))
+        else:
+            self._writer.write_batch(batch)
+
+    def _close(self):
+        self._writer.close()
+
+
+# Excel number formats for typed columns
+XLSX_NUMBER_FORMATS = {
+    "LATITUDE": '0.000000',
+    "LONGITUDE": '0.000000',
+    "VALOR MINIMO": '#,##0.00',
+    "AVALIACAO": '0.0',
+    "TEMPO ENTREGA": '0',
+    "VALOR ORIGINAL": '#,##0.00',
+}
+
+
+class XlsxWorkbook:
+    """
+    Streaming xlsx workbook with one sheet per category
+
+    Uses openpyxl's write-only mode: rows go straight to the sheet's part on
+    disk instead of a cell tree in memory, so memory stays constant however
+    many rows are written. The workbook is saved (and only then readable)
+    on close.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path: Output .xlsx file
+        """
+        if not HAS_OPENPYXL:
+            raise ImportError("openpyxl is required for xlsx output (pip install openpyxl)")
+        self.path = str(path)
+        self.closed = False
+        self._workbook = Workbook(write_only=True)
+        self._sheets = []
+
+    def sheet(self, name: str, columns: List[str], **options) -> 'XlsxSink':
+        """
+        Add a sheet and return the sink that streams rows into it
+
+        Args:
+            name: Sheet name (e.g. the category alias; Excel allows 31 characters)
+            columns: Output columns, in order
+            **options: flush_rows / flush_interval (see ResultSink)
+
+        Returns:
+            XlsxSink for the new sheet
+        """
+        sink = XlsxSink(self.path, columns, name, workbook=self, **options)
+        self._sheets.append(sink)
+        return sink
+
+    def _create_sheet(self, name: str):
+        return self._workbook.create_sheet(name[:31])
+
+    def close(self):
+        """Flush every sheet and save the workbook (a write-only workbook saves once; later calls do nothing)"""
+        if self.closed:
+            return
+        self.closed = True
+        for sink in self._sheets:
+            sink.flush()
+        self._workbook.save(self.path)
+
+
+class XlsxSink(ResultSink):
+    """
+    xlsx output for one sheet, streamed in openpyxl write-only mode
+
+    Numeric columns (see COLUMN_TYPES) are written as numbers with Excel
+    number formats rather than text; SUPER RESTAURANTE keeps its SIM/NAO
+    values. A sink opened on its own owns a single-sheet workbook and saves
+    it on close; sinks from XlsxWorkbook.sheet are saved by the workbook.
+    """
+
+    def __init__(self, path, columns: List[str], sheet_name: str = 'RESULTADO',
+                 workbook: Optional[XlsxWorkbook] = None, flush_rows: int = 500, flush_interval: float = 5.0):
+        """
+        Args:
+            path: Output .xlsx file (ignored when workbook is given)
+            columns: Output columns, in order
+            sheet_name: Name of the sheet
+            workbook: Shared workbook to add the sheet to (default: a new one)
+            flush_rows: Rows buffered before they are written
+            flush_interval: Seconds after which buffered rows are written anyway
+        """
+        self._owns_workbook = workbook is None
+        if workbook is None:
+            workbook = XlsxWorkbook(path)
+        super().__init__(workbook.path, columns, flush_rows, flush_interval)
+        self.workbook = workbook
+        self._sheet = workbook._create_sheet(sheet_name)
+        self._types = [COLUMN_TYPES.get(column) if COLUMN_TYPES.get(column) in ('float64', 'int32') else None
+                       for column in columns]
+
+        header = []
+        for column in columns:
+            cell = WriteOnlyCell(self._sheet, column)
+            cell.font = Font(bold=True)
+            header.append(cell)
+        self._sheet.append(header)
+
+    def _write_rows(self, rows: List[Dict]):
+        for row in rows:
+            values = []
+            for column, column_type in zip(self.columns, self._types):
+                value = row.get(column)
+                if column_type is not None:
+                    cell = WriteOnlyCell(self._sheet, convert_value(value, column_type))
+                    cell.number_format = XLSX_NUMBER_FORMATS.get(column, 'General')
+                    values.append(cell)
+                else:
+                    values.append(convert_value(value, 'string'))
+            self._sheet.append(values)
+
+    def _close(self):
+        if self._owns_workbook:
+            self.workbook.close()
+
+
+# Output formats: file extension of each
+OUTPUT_FORMATS = {
+    'csv': 'csv',
+    'parquet': 'parquet',
+    'feather': 'feather',
+    'xlsx': 'xlsx',
+}
+
+
+def output_columns() -> List[str]:
+    """CSV columns plus any extra fields requested (see set_detail_fields)"""
+    return OUTPUT_COLUMNS + list(get_detail_fields())
+
+
+def open_result_sink(category: str, output_dir: Path = None, fmt: str = 'csv', **options) -> ResultSink:
+    """
+    Open the streaming output file for a category
+
+    Args:
+        category: Category name for the output file
+        output_dir: Directory to save the file (default: current directory)
+        fmt: Output format, one of OUTPUT_FORMATS
+        **options: flush_rows / flush_interval (see ResultSink)
+
+    Returns:
+        A sink writing RESULTADO <CATEGORY> IFOOD.<extension>
+    """
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{fmt}', expected one of: {', '.join(OUTPUT_FORMATS)}")
+    if output_dir is None:
+        output_dir = Path.cwd()
+    output_file = output_dir / f"RESULTADO {category.upper()} IFOOD.{OUTPUT_FORMATS[fmt]}"
+    if fmt == 'csv':
+        return CsvSink(output_file, output_columns(), **options)
+    if fmt == 'xlsx':
+        return XlsxSink(output_file, output_columns(), category.upper(), **options)
+    return ArrowSink(output_file, output_columns(), fmt, **options)
+
+
+def export_to_csv(data: Iterable[Dict], category: str, output_dir: Path = None) -> str:
     """
     Export merchant data to CSV file
 
     Args:
-        data: List of merchant data dictionaries
+        data: Merchant data dictionaries (a list or any iterable, written as it is consumed)
+        category: Category name for the output file
+        output_dir: Directory to save the CSV (default: current directory)
+
+    Returns:
+        Path to the created CSV file
+    """
+    with open_result_sink(category, output_dir) as sink:
+        for row in data:
+            sink.write(row)
+
+    return sink.path
+
+
+def export_to_xlsx(data_by_category: Dict[str, Iterable[Dict]], output_file) -> str:
+    """
+    Export several categories to one xlsx workbook, one sheet each
+
+    Args:
+        data_by_category: Category name -> merchant data dictionaries (consumed as written)
+        output_file: Path of the .xlsx file
+
+    Returns:
+        Path to the created file
+    """
+    workbook = XlsxWorkbook(output_file)
+    for category, data in data_by_category.items():
+        sheet = workbook.sheet(category.upper(), output_columns())
+        for row in data:
+            sheet.write(row)
+    workbook.close()
+
+    return workbook.path
+
+
+def export_to_parquet(data: Iterable[Dict], category: str, output_dir: Path = None, fmt: str = 'parquet') -> str:
+    """
+    Export merchant data to a typed Parquet (or Feather) file
+
+    Args:
+        data: Merchant data dictionaries (a list or any iterable, written as it is consumed)
+        category: Category name for the output file
+        output_dir: Directory to save the file (default: current directory)
+        fmt: 'parquet' or 'feather'
+
+    Returns:
+        Path to the created file
+    """
+    with open_result_sink(category, output_dir, fmt) as sink:
+        for row in data:
+            sink.write(row)
+
+    return sink.path
+
+
+def normalize_row(row: Dict) -> Dict:
+    """Canonical form of a detail row for change detection (stripped strings, sorted keys)"""
+    return {key: value.strip() if isinstance(value, str) else value for key, value in sorted(row.items())}
+
+
+def row_hash(row: Dict) -> str:
+    """Stable hash of a detail row's normalized content"""
+    canonical = json.dumps(normalize_row(row), ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class MerchantDelta(NamedTuple):
+    """Differences between the previous run and this one"""
+    new: List[Tuple[str, Dict]]
+    changed: List[Tuple[str, Dict, List[str]]]  # (merchant_id, row, changed columns)
+    removed: List[Tuple[str, Dict]]  # (merchant_id, last known row)
+    unchanged: int
+
+
+class DeltaState:
+    """
+    Last known detail row and hash of every merchant, per category
+
+    Kept in SQLite between runs so each run can report only what changed
+    since the previous one (see compute_delta).
+    """
+
+    def __init__(self, path='delta_state.db'):
+        """
+        Args:
+            path: SQLite database file
+        """
+        self.path = str(path)
+        self._db = sqlite3.connect(self.path)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS merchants (category TEXT, merchant_id TEXT, hash TEXT, row TEXT,'
+            ' PRIMARY KEY (category, merchant_id))'
+        )
+
+    def load(self, category: str) -> Dict[str, Tuple[str, Dict]]:
+        """merchant_id -> (hash, row) as of the previous run"""
+        rows = self._db.execute('SELECT merchant_id, hash, row FROM merchants WHERE category = ?', (category,))
+        return {merchant_id: (digest, json.loads(row)) for merchant_id, digest, row in rows}
+
+    def save(self, category: str, state: Dict[str, Tuple[str, Dict]]):
+        """Replace the category's state in one transaction"""
+        with self._db:
+            self._db.execute('DELETE FROM merchants WHERE category = ?', (category,))
+            self._db.executemany(
+                'INSERT INTO merchants VALUES (?, ?, ?, ?)',
+                [(category, merchant_id, digest, json.dumps(row, ensure_ascii=False))
+                 for merchant_id, (digest, row) in state.items()]
+            )
+
+    def close(self):
+        self._db.close()
+
+
+def compute_delta(
+    previous: Dict[str, Tuple[str, Dict]],
+    current: Iterable[Tuple[str, Dict]],
+    discovered: Iterable[str]
+) -> Tuple[MerchantDelta, Dict[str, Tuple[str, Dict]]]:
+    """
+    Compare this run's detail rows against the previous state
+
+    A merchant only counts as removed when discovery no longer finds it;
+    merchants that were found but whose details failed keep their previous
+    state instead.
+
+    Args:
+        previous: State from DeltaState.load
+        current: (merchant_id, row) fetched in this run
+        discovered: Every merchant ID discovery found in this run
+
+    Returns:
+        (delta, new state to save)
+    """
+    state = {}
+    new, changed = [], []
+    unchanged = 0
+
+    for merchant_id, row in current:
+        digest = row_hash(row)
+        state[merchant_id] = (digest, row)
+        if merchant_id not in previous:
+            new.append((merchant_id, row))
+            continue
+        old_digest, old_row = previous[merchant_id]
+        if digest == old_digest:
+            unchanged += 1
+            continue
+        old, now = normalize_row(old_row), normalize_row(row)
+        fields = [key for key in dict.fromkeys(list(now) + list(old)) if old.get(key) != now.get(key)]
+        changed.append((merchant_id, row, fields))
+
+    discovered = set(discovered)
+    removed = []
+    for merchant_id, (digest, row) in previous.items():
+        if merchant_id in state:
+            continue
+        if merchant_id in discovered:
+            state[merchant_id] = (digest, row)  # details failed this run, keep what we knew
+        else:
+            removed.append((merchant_id, row))
+
+    return MerchantDelta(new, changed, removed, unchanged), state
+
+
+def export_delta_csv(delta: MerchantDelta, category: str, output_dir: Path = None) -> str:
+    """
+    Export only new, changed and removed merchants to CSV
+
+    Besides the regular columns, each row has the merchant ID, the kind of
+    change (NOVO, ALTERADO or REMOVIDO) and, for changed merchants, the
+    columns that changed.
+
+    Args:
+        delta: Result of compute_delta
         category: Category name for the output file
         output_dir: Directory to save the CSV (default: current directory)
 
@@ -407,15 +3442,14 @@ def export_to_csv(data: List[Dict], category: str, output_dir: Path = None) -> s
     if output_dir is None:
         output_dir = Path.cwd()
 
-    columns = [
-        "NOME", "RUA", "NUMERO", "BAIRRO", "CIDADE", "CEP",
-        "LATITUDE", "LONGITUDE", "CNPJ", "PRECO MEDIO",
-        "VALOR MINIMO", "CATEGORIA", "AVALIACAO",
-        "TEMPO ENTREGA", "VALOR ORIGINAL", "SUPER RESTAURANTE"
-    ]
-
-    df = pd.DataFrame(data, columns=columns)
-    output_file = output_dir / f"RESULTADO {category.upper()} IFOOD.csv"
-    df.to_csv(output_file, index=False, encoding='utf-8-sig')
+    columns = ["ID", "ALTERACAO", "CAMPOS ALTERADOS"] + output_columns()
+    output_file = output_dir / f"DELTA {category.upper()} IFOOD.csv"
+    with CsvSink(output_file, columns) as sink:
+        for merchant_id, row in delta.new:
+            sink.write({"ID": merchant_id, "ALTERACAO": "NOVO", "CAMPOS ALTERADOS": "", **row})
+        for merchant_id, row, fields in delta.changed:
+            sink.write({"ID": merchant_id, "ALTERACAO": "ALTERADO", "CAMPOS ALTERADOS": ", ".join(fields), **row})
+        for merchant_id, row in delta.removed:
+            sink.write({"ID": merchant_id, "ALTERACAO": "REMOVIDO", "CAMPOS ALTERADOS": "", **row})
 
     return str(output_file)